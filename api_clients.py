@@ -1,72 +1,821 @@
+import json
 import logging
+import math
 import requests
 import random
-import praw
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from functools import partial
+from urllib.parse import urlsplit
+from xml.etree import ElementTree
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from config import (
     REDDIT_CLIENT_ID, REDDIT_CLIENT_SECRET, REDDIT_USER_AGENT,
-    MIKU_SUBREDDITS, WAIFU_PICS_API, ANIME_PICS_API, SAFEBOORU_API
+    MIKU_SUBREDDITS, REDDIT_LISTING_TTL, REDDIT_MAX_REQUESTS_PER_MINUTE, REDDIT_REQUEST_BURST,
+    WAIFU_PICS_MANY_API, ANIME_PICS_API, SAFEBOORU_API,
+    SAFEBOORU_COUNT_API, SAFEBOORU_PAGE_SIZE, SAFEBOORU_COUNT_TTL,
+    SAFEBOORU_POSTS_API, SAFEBOORU_INDEX_FILE,
+    HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_MAX_RETRIES,
+    HTTP_BACKOFF_FACTOR, HTTP_MAX_RETRY_AFTER, HTTP_POOL_SIZE, HTTP_CACHE_MAX_BYTES, HTTP_CACHE_DEFAULT_TTL,
+    IMAGE_FETCH_MODE, IMAGE_FETCH_WORKERS, IMAGE_HEDGE_PERCENTILE,
+    IMAGE_POOL_TTL, IMAGE_POOL_LOW_WATER, IMAGE_POOL_EMPTY_RETRY
 )
+from storage import Post, is_in_history, filter_new_posts
+from safebooru_index import SafebooruIndex
+import metrics
+import source_health
 import time
 
 logger = logging.getLogger(__name__)
 
-# Global variable for Reddit client
-reddit_client = None
+# Status codes worth retrying: rate limiting and transient server errors
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# One pooled session per host, so connections are reused across fetches
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+class JitteredRetry(Retry):
+    """
+    Retry policy with "full jitter": each backoff sleeps a random time between
+    zero and the exponential delay, so workers that failed together don't all
+    retry at the same moment.
+    
+    A Retry-After header is still honoured, but never for longer than
+    HTTP_MAX_RETRY_AFTER: a rate-limited API answering "Retry-After: 3600"
+    would otherwise park the calling thread for an hour.
+    """
+
+    def get_backoff_time(self):
+        return random.uniform(0, super().get_backoff_time())
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            return None
+        return min(retry_after, HTTP_MAX_RETRY_AFTER)
+
+def _create_session():
+    retry = JitteredRetry(
+        total=HTTP_MAX_RETRIES,
+        backoff_factor=HTTP_BACKOFF_FACTOR,
+        status_forcelist=RETRY_STATUSES,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=1, pool_maxsize=HTTP_POOL_SIZE)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def get_session(url):
+    """
+    Get the shared keep-alive session for a URL's host.
+    
+    Args:
+        url (str): Any URL on the host
+        
+    Returns:
+        requests.Session: Session with connection pooling and retries
+    """
+    host = urlsplit(url).netloc.lower()
+    session = _sessions.get(host)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(host)
+            if session is None:
+                session = _sessions[host] = _create_session()
+    return session
+
+def http_get(url, **kwargs):
+    """
+    GET a URL through the pooled session for its host.
+    
+    Connect and read timeouts default to HTTP_CONNECT_TIMEOUT and
+    HTTP_READ_TIMEOUT; connection errors and retryable statuses are retried
+    with jittered exponential backoff before an error is raised or the last
+    response is returned.
+    
+    Args:
+        url (str): The URL to fetch
+        **kwargs: Passed on to requests (params, stream, timeout, ...)
+        
+    Returns:
+        requests.Response: The response
+    """
+    kwargs.setdefault("timeout", (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+    return get_session(url).get(url, **kwargs)
+
+def http_post(url, **kwargs):
+    """
+    POST to a URL through the pooled session for its host.
+    
+    Uses the same timeouts as http_get. Failed connections are retried, but
+    since POST isn't idempotent, retryable statuses are returned as-is.
+    
+    Args:
+        url (str): The URL to post to
+        **kwargs: Passed on to requests (json, data, timeout, ...)
+        
+    Returns:
+        requests.Response: The response
+    """
+    kwargs.setdefault("timeout", (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+    return get_session(url).post(url, **kwargs)
+
+class CachedResponse:
+    """
+    A cached 200 response, standing in for requests.Response in the fetchers.
+    The JSON body is parsed once and shared by every hit, so treat it as
+    read-only.
+    """
+    
+    _NOT_PARSED = object()
+    
+    def __init__(self, url, content, headers):
+        self.url = url
+        self.status_code = 200
+        self.content = content
+        self.headers = headers
+        self._json = self._NOT_PARSED
+        
+    def json(self):
+        if self._json is self._NOT_PARSED:
+            self._json = json.loads(self.content)
+        return self._json
+
+class _CacheEntry:
+    __slots__ = ("response", "etag", "last_modified", "expires_at", "size")
+
+class HTTPCache:
+    """
+    Response cache for GET requests to the source APIs.
+    
+    A response stays fresh for its Cache-Control max-age, or `default_ttl`
+    seconds when the server doesn't say; no-store responses aren't kept and
+    no-cache ones are revalidated every time. Once stale, an entry with an
+    ETag or Last-Modified is revalidated with If-None-Match/If-Modified-Since,
+    so an unchanged listing costs a 304 instead of a full download. Entries
+    are evicted least recently used first once their bodies exceed
+    `max_bytes`.
+    """
+    
+    def __init__(self, max_bytes=HTTP_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        
+    @staticmethod
+    def _freshness(headers, default_ttl):
+        """
+        Returns:
+            float: Seconds the response stays fresh, or None if it must not be stored
+        """
+        directives = {}
+        for directive in headers.get("Cache-Control", "").lower().split(","):
+            name, _, value = directive.strip().partition("=")
+            directives[name] = value.strip('"')
+            
+        if "no-store" in directives:
+            return None
+        if "no-cache" in directives:
+            return 0
+        if "max-age" in directives:
+            try:
+                return max(0, int(directives["max-age"]) - int(headers.get("Age", 0)))
+            except ValueError:
+                pass
+        return default_ttl
+        
+    def get(self, url, params=None, default_ttl=HTTP_CACHE_DEFAULT_TTL):
+        """
+        GET a URL, from the cache when possible.
+        
+        Args:
+            url (str): The URL to fetch
+            params (dict, optional): Query parameters
+            default_ttl (float): Freshness for responses without Cache-Control;
+                0 means only reuse them after a successful revalidation
+            
+        Returns:
+            CachedResponse or requests.Response: A CachedResponse for 200s
+                (cached or not), otherwise the server's response
+        """
+        full_url = requests.Request("GET", url, params=params).prepare().url
+        with self._lock:
+            entry = self._entries.get(full_url)
+            if entry is not None:
+                self._entries.move_to_end(full_url)
+                
+        now = time.monotonic()
+        if entry is not None and now < entry.expires_at:
+            metrics.increment("http_cache.hits")
+            return entry.response
+            
+        headers = {}
+        if entry is not None:
+            if entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+        response = http_get(full_url, headers=headers)
+        
+        if response.status_code == 304 and entry is not None:
+            metrics.increment("http_cache.revalidated")
+            # A 304 only carries the headers that changed
+            entry.response.headers.update(response.headers)
+            freshness = self._freshness(entry.response.headers, default_ttl)
+            entry.expires_at = now + (freshness or 0)
+            entry.etag = entry.response.headers.get("ETag")
+            entry.last_modified = entry.response.headers.get("Last-Modified")
+            return entry.response
+            
+        metrics.increment("http_cache.misses")
+        if response.status_code != 200:
+            return response
+            
+        cached = CachedResponse(full_url, response.content, response.headers)
+        self._store(full_url, cached, self._freshness(response.headers, default_ttl), now)
+        return cached
+        
+    def _store(self, url, response, freshness, now):
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        size = len(response.content)
+        if freshness is None or (not freshness and not etag and not last_modified) or size > self.max_bytes:
+            # Not storable, or it could never be reused
+            self._remove(url)
+            return
+            
+        entry = _CacheEntry()
+        entry.response = response
+        entry.etag = etag
+        entry.last_modified = last_modified
+        entry.expires_at = now + freshness
+        entry.size = size
+        with self._lock:
+            old = self._entries.pop(url, None)
+            if old is not None:
+                self._size -= old.size
+            self._entries[url] = entry
+            self._size += size
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= evicted.size
+                metrics.increment("http_cache.evictions")
+            metrics.set_gauge("http_cache.bytes", self._size)
+            
+    def _remove(self, url):
+        with self._lock:
+            old = self._entries.pop(url, None)
+            if old is not None:
+                self._size -= old.size
+                
+    def clear(self):
+        """Drop every cached response"""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+_http_cache = HTTPCache()
+
+def cached_get(url, params=None, default_ttl=HTTP_CACHE_DEFAULT_TTL):
+    """
+    GET a source API listing through the shared response cache.
+    
+    Args:
+        url (str): The URL to fetch
+        params (dict, optional): Query parameters
+        default_ttl (float): Seconds to reuse a response that has no
+            Cache-Control; 0 for endpoints whose results change every call
+        
+    Returns:
+        CachedResponse or requests.Response: See HTTPCache.get
+    """
+    return _http_cache.get(url, params=params, default_ttl=default_ttl)
+
+# Workers for concurrent image fetches. Requests that lost the race keep
+# running here until their timeouts, so it's sized above the source count.
+_fetch_pool = ThreadPoolExecutor(max_workers=IMAGE_FETCH_WORKERS, thread_name_prefix="image-fetch")
+
+# Latency samples a source needs before it can be hedged
+HEDGE_MIN_SAMPLES = 20
+
+class RateLimiter:
+    """
+    Token bucket: `rate` requests per second on average, with up to
+    `burst` at once after a quiet spell. Callers block until they may go.
+    """
+    
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        
+    def acquire(self):
+        """
+        Returns:
+            float: Seconds spent waiting
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Take the token now, even if it's still owed, so waiters queue up in order
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+# Shared by every Reddit client, since Reddit's limit is per app
+_reddit_rate_limiter = RateLimiter(REDDIT_MAX_REQUESTS_PER_MINUTE / 60, REDDIT_REQUEST_BURST)
+
+# Reddit client, created by the first get_reddit_client call
+_reddit_client = None
+_reddit_client_attempted = False
+_reddit_client_lock = threading.Lock()
+
+def create_reddit_client(requests_metric="reddit.requests"):
+    """
+    Create a new Reddit client. PRAW clients aren't thread-safe, so a thread
+    that talks to Reddit on its own (like the stream worker) gets its own.
+    
+    praw is imported here rather than at module level: it's one of the
+    slowest imports in the bot and only the Reddit features need it.
+    Creating the client makes no requests.
+    
+    Every client's requests share one rate limit.
+    
+    Args:
+        requests_metric (str): Counter incremented for every HTTP request
+            the client makes
+            
+    Returns:
+        praw.Reddit: The client, or None if the credentials are missing
+    """
+    if not (REDDIT_CLIENT_ID and REDDIT_CLIENT_SECRET):
+        return None
+        
+    import praw
+    import prawcore
+    
+    class CountingRequestor(prawcore.Requestor):
+        def request(self, *args, **kwargs):
+            waited = _reddit_rate_limiter.acquire()
+            if waited:
+                metrics.observe("reddit.rate_limit.wait_seconds", waited)
+            metrics.increment(requests_metric)
+            return super().request(*args, **kwargs)
+            
+    return praw.Reddit(
+        client_id=REDDIT_CLIENT_ID,
+        client_secret=REDDIT_CLIENT_SECRET,
+        user_agent=REDDIT_USER_AGENT,
+        requestor_class=CountingRequestor
+    )
+
+def get_reddit_client():
+    """
+    Return the shared Reddit client, creating it on first use.
+    If credentials are missing or creation fails, that's logged once and
+    None is returned from then on.
+    
+    Returns:
+        praw.Reddit: The client, or None if Reddit features are disabled
+    """
+    global _reddit_client, _reddit_client_attempted
+    
+    if _reddit_client_attempted:
+        return _reddit_client
+        
+    with _reddit_client_lock:
+        if _reddit_client_attempted:
+            return _reddit_client
+            
+        try:
+            _reddit_client = create_reddit_client()
+            if _reddit_client:
+                logger.info("Reddit client initialized")
+            else:
+                logger.warning("Reddit API credentials not found, Reddit features disabled")
+        except Exception as e:
+            logger.error(f"Error initializing Reddit client: {e}")
+        _reddit_client_attempted = True
+        return _reddit_client
 
 def initialize_reddit_client():
     """Initialize and return the Reddit client if credentials are available"""
-    global reddit_client
+    return get_reddit_client()
+
+class RedditListingCache:
+    """
+    Recently fetched subreddit listings, shared by fetch_reddit_post and the
+    Reddit tracker so they don't request the same listing separately.
+    
+    Listings are keyed by (subreddit, sort, time_filter) and stay fresh for
+    their sort's TTL. A request for more submissions than the cached listing
+    holds fetches it again at the larger limit, and refreshes keep that
+    limit, so callers asking for different amounts end up sharing one
+    request. Each time a listing is served from the cache, one Reddit API
+    call has been saved.
+    """
     
-    if reddit_client:
-        return reddit_client  # Already initialized
+    def __init__(self, ttls=REDDIT_LISTING_TTL):
+        """
+        Args:
+            ttls (dict): Seconds a listing stays fresh, by sort
+        """
+        self.ttls = ttls
+        self._entries = {}  # key -> (fetched_at, limit, submissions)
+        self._saved_at = deque()  # When calls were saved, over the last hour
+        self._lock = threading.Lock()
+        
+    def get(self, subreddit_name, sort, limit, time_filter=None, reddit_client=None):
+        """
+        Args:
+            subreddit_name (str): Subreddit to list
+            sort (str): "new", "hot" or "top"
+            limit (int): Number of submissions wanted
+            time_filter (str, optional): Period for "top" listings, e.g. "week"
+            reddit_client (praw.Reddit, optional): Client to fetch with, for
+                threads with their own; defaults to the shared one
+            
+        Returns:
+            list: Up to `limit` submissions in listing order, or an empty list
+                if there is no Reddit client. Fetch errors are raised and
+                aren't cached.
+        """
+        key = (subreddit_name.lower(), sort, time_filter)
+        fetch_limit = limit
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None:
+            fetched_at, fetched_limit, submissions = entry
+            fresh = time.monotonic() - fetched_at < self.ttls.get(sort, 0)
+            # A listing shorter than its limit already holds everything there is
+            if fresh and (fetched_limit >= limit or len(submissions) < fetched_limit):
+                self._record(sort, saved=True)
+                return submissions[:limit]
+            fetch_limit = max(limit, fetched_limit)
+            
+        reddit_client = reddit_client or get_reddit_client()
+        if not reddit_client:
+            return []
+            
+        listing = getattr(reddit_client.subreddit(subreddit_name), sort)
+        kwargs = {"time_filter": time_filter} if time_filter else {}
+        started = time.perf_counter()
+        submissions = list(listing(limit=fetch_limit, **kwargs))
+        metrics.observe("reddit.listing.seconds", time.perf_counter() - started)
         
-    if REDDIT_CLIENT_ID and REDDIT_CLIENT_SECRET:
+        with self._lock:
+            self._entries[key] = (time.monotonic(), fetch_limit, submissions)
+        self._record(sort, saved=False)
+        return submissions[:limit]
+        
+    def _record(self, sort, saved):
+        if saved:
+            metrics.increment("reddit.listing.cache_hits")
+        else:
+            metrics.increment("reddit.listing.requests")
+            metrics.increment(f"reddit.listing.requests.{sort}")
+        now = time.monotonic()
+        with self._lock:
+            if saved:
+                self._saved_at.append(now)
+            while self._saved_at and self._saved_at[0] <= now - 3600:
+                self._saved_at.popleft()
+            saved_last_hour = len(self._saved_at)
+        metrics.set_gauge("reddit.listing.calls_saved_per_hour", saved_last_hour)
+
+_reddit_listings = RedditListingCache()
+
+def get_reddit_listing(subreddit_name, sort, limit, time_filter=None, reddit_client=None):
+    """
+    Submissions of a subreddit listing, through the shared listing cache.
+    See RedditListingCache.get.
+    """
+    return _reddit_listings.get(subreddit_name, sort, limit, time_filter, reddit_client)
+
+class CandidatePool:
+    """
+    In-memory pool of new images from one source's batch responses.
+    
+    Each refill keeps every post in the response that isn't already in the
+    history, so later requests are served from memory instead of fetching
+    the same batch again. Candidates are re-checked against the history
+    when taken and expire after `ttl` seconds. Once the pool drops below
+    `low_water` it refills in the background; a request that finds it empty
+    refills it first. When `max_batches` batches in a row turn up nothing
+    new, the source isn't asked again for IMAGE_POOL_EMPTY_RETRY seconds.
+    Candidates taken but not used go back with put_back.
+    """
+    
+    def __init__(self, name, fetch_batch, low_water=IMAGE_POOL_LOW_WATER, ttl=IMAGE_POOL_TTL,
+                 max_batches=1):
+        """
+        Args:
+            name (str): Source name used in logs and metrics
+            fetch_batch (callable): Returns a list of Posts, or None on failure
+            low_water (int): Pool size below which a background refill starts
+            ttl (float): Seconds a candidate stays usable after it was fetched
+            max_batches (int): Batches one refill may fetch looking for new
+                posts, for sources whose batches differ from call to call
+        """
+        self.name = name
+        self.low_water = low_water
+        self.ttl = ttl
+        self.max_batches = max_batches
+        self._fetch_batch = fetch_batch
+        self._candidates = []  # (fetched_at, Post)
+        self._lock = threading.Lock()
+        self._refill_lock = threading.Lock()
+        self._retry_at = 0
+        # Whether the last batch request failed, as opposed to the source
+        # just having nothing new
+        self.failing = False
+        
+    def __len__(self):
+        return len(self._candidates)
+        
+    def take(self):
+        """
+        Remove and return a random candidate that still isn't in the history.
+        
+        Returns:
+            Post: The candidate, or None if the source has nothing new
+        """
+        post = self._pop_new()
+        if post is None:
+            metrics.increment(f"images.pool.{self.name}.misses")
+            self._refill(below=1)
+            post = self._pop_new()
+        else:
+            metrics.increment(f"images.pool.{self.name}.hits")
+            
+        if (len(self) < self.low_water and not self._refill_lock.locked()
+                and time.monotonic() >= self._retry_at):
+            _fetch_pool.submit(self._refill, self.low_water)
+        return post
+        
+    def put_back(self, post):
+        """
+        Return a candidate from take that ended up unused, e.g. because
+        another source answered first. It gets a fresh TTL.
+        
+        Args:
+            post (Post): The candidate
+        """
+        now = time.monotonic()
+        with self._lock:
+            if any(pooled.normalized_url == post.normalized_url for _, pooled in self._candidates):
+                return
+            self._candidates.append((now, post))
+            metrics.set_gauge(f"images.pool.{self.name}.size", len(self._candidates))
+        metrics.increment(f"images.pool.{self.name}.returned")
+        
+    def _pop_new(self):
+        while True:
+            with self._lock:
+                expired_before = time.monotonic() - self.ttl
+                self._candidates = [c for c in self._candidates if c[0] > expired_before]
+                if not self._candidates:
+                    return None
+                # Swap the chosen candidate to the end so removal is O(1)
+                index = random.randrange(len(self._candidates))
+                candidates = self._candidates
+                candidates[index], candidates[-1] = candidates[-1], candidates[index]
+                _, post = candidates.pop()
+                metrics.set_gauge(f"images.pool.{self.name}.size", len(candidates))
+            # It may have been posted since it was fetched
+            if filter_new_posts([post]):
+                return post
+                
+    def _refill(self, below):
+        """
+        Fetch a batch and add its new posts, unless the pool already holds at
+        least `below` candidates by the time this refill gets its turn.
+        """
+        with self._refill_lock:
+            if len(self) >= below or time.monotonic() < self._retry_at:
+                return
+            for _ in range(self.max_batches):
+                try:
+                    batch = self._fetch_batch()
+                except Exception as e:
+                    logger.error(f"Error refilling {self.name} candidate pool: {e}")
+                    batch = None
+                self.failing = batch is None
+                batch = batch or []
+                metrics.increment(f"images.pool.{self.name}.refills")
+                
+                new_posts = filter_new_posts(batch)
+                now = time.monotonic()
+                with self._lock:
+                    pooled = {post.normalized_url for _, post in self._candidates}
+                    self._candidates.extend(
+                        (now, post) for post in new_posts if post.normalized_url not in pooled
+                    )
+                    metrics.set_gauge(f"images.pool.{self.name}.size", len(self._candidates))
+                    
+                if new_posts:
+                    logger.info(f"Refilled {self.name} pool with {len(new_posts)} of {len(batch)} posts")
+                    return
+                
+            logger.warning(f"No new {self.name} images in {self.max_batches} batch(es), "
+                           f"pausing refills for {IMAGE_POOL_EMPTY_RETRY:.0f}s")
+            self._retry_at = time.monotonic() + IMAGE_POOL_EMPTY_RETRY
+
+class SafebooruPageSampler:
+    """
+    Picks Safebooru result pages so the whole tag result set gets sampled.
+    
+    Without a page number Safebooru only ever returns the newest posts. The
+    total post count comes from the `count` attribute of the XML API's
+    response and is cached for `count_ttl` seconds. Pages are dealt from a
+    shuffled deck of every page (stratified sampling): each page is equally
+    likely, and no page repeats until all of them have been visited.
+    """
+    
+    def __init__(self, page_size=SAFEBOORU_PAGE_SIZE, count_ttl=SAFEBOORU_COUNT_TTL):
+        """
+        Args:
+            page_size (int): Posts per page
+            count_ttl (float): Seconds before the post count is fetched again
+        """
+        self.page_size = page_size
+        self.count_ttl = count_ttl
+        self._count = None
+        self._count_checked_at = None
+        self._page_count = 0
+        self._pages = []
+        self._lock = threading.Lock()
+        
+    def _fetch_count(self):
         try:
-            reddit_client = praw.Reddit(
-                client_id=REDDIT_CLIENT_ID,
-                client_secret=REDDIT_CLIENT_SECRET,
-                user_agent=REDDIT_USER_AGENT
-            )
-            logger.info("Reddit client initialized")
-            return reddit_client
+            response = cached_get(SAFEBOORU_COUNT_API)
+            if response.status_code == 200:
+                return int(ElementTree.fromstring(response.content).get("count"))
+            logger.warning(f"Safebooru count request returned HTTP {response.status_code}")
         except Exception as e:
-            logger.error(f"Error initializing Reddit client: {e}")
-            return None
-    else:
-        logger.warning("Reddit API credentials not found, Reddit features disabled")
+            logger.error(f"Error fetching Safebooru post count: {e}")
         return None
+        
+    def post_count(self):
+        """
+        Returns:
+            int: Total posts matching the tags, or None if it isn't known
+        """
+        now = time.monotonic()
+        if self._count_checked_at is None or now - self._count_checked_at >= self.count_ttl:
+            # On failure keep the last known count until the next refresh
+            self._count_checked_at = now
+            count = self._fetch_count()
+            if count is not None:
+                self._count = count
+                metrics.set_gauge("images.safebooru.post_count", count)
+        return self._count
+        
+    def next_page(self):
+        """
+        Returns:
+            int: The page (pid) to fetch next; 0 if the count is unknown
+        """
+        count = self.post_count()
+        if not count:
+            return 0
+        page_count = math.ceil(count / self.page_size)
+        with self._lock:
+            if not self._pages or page_count != self._page_count:
+                self._pages = list(range(page_count))
+                random.shuffle(self._pages)
+                self._page_count = page_count
+            return self._pages.pop()
 
-# Initialize Reddit client on module import
-initialize_reddit_client()
+_safebooru_sampler = SafebooruPageSampler()
 
-def fetch_image_from_waifu_pics():
+def fetch_safebooru_batch():
     """
-    Fetch an anime image from waifu.pics API.
-    This is only used as a fallback since it's harder to get specific Miku images.
+    Fetch one randomly sampled page of Miku posts from Safebooru.
+    
+    Returns:
+        list: Post records for every image on the page, or None on failure
+    """
+    try:
+        params = {"limit": SAFEBOORU_PAGE_SIZE, "pid": _safebooru_sampler.next_page()}
+        response = cached_get(SAFEBOORU_API, params=params)
+        if response.status_code == 200:
+            # Safebooru answers with an empty body when there are no results
+            posts = response.json() if response.content.strip() else []
+            return [
+                Post(
+                    # Safebooru image URL format
+                    image_url=f"https://safebooru.org/images/{post['directory']}/{post['image']}",
+                    source=f"Safebooru - Post #{post['id']}"
+                )
+                for post in posts
+            ]
+    except Exception as e:
+        logger.error(f"Error fetching from Safebooru: {e}")
+    return None
+
+# Pages are sampled at random, so a page with nothing new doesn't mean the
+# next one won't have anything either
+_safebooru_pool = CandidatePool("safebooru", fetch_safebooru_batch, max_batches=3)
+
+def fetch_safebooru_page(tags):
+    """
+    Fetch the newest page of Safebooru posts matching a tag query.
     
+    Args:
+        tags (str): Safebooru tag query, e.g. "nakano_miku id:>1234"
+        
     Returns:
-        dict: Contains image_url and source
+        list: Post metadata dicts (empty when nothing matches), or None on failure
+    """
+    try:
+        params = {"tags": tags, "limit": SAFEBOORU_PAGE_SIZE}
+        response = cached_get(SAFEBOORU_POSTS_API, params=params)
+        if response.status_code == 200:
+            return response.json() if response.content.strip() else []
+        logger.warning(f"Safebooru returned HTTP {response.status_code} for '{tags}'")
+    except Exception as e:
+        logger.error(f"Error fetching Safebooru page: {e}")
+    return None
+
+_safebooru_index = None
+_safebooru_index_lock = threading.Lock()
+
+def get_safebooru_index():
+    """
+    Open the local Safebooru index and start syncing it, on first use.
+    
+    Returns:
+        SafebooruIndex: The index, or None if it is disabled or can't be opened
+    """
+    global _safebooru_index
+    if _safebooru_index is None and SAFEBOORU_INDEX_FILE:
+        with _safebooru_index_lock:
+            if _safebooru_index is None:
+                try:
+                    index = SafebooruIndex(SAFEBOORU_INDEX_FILE)
+                    index.start_sync(fetch_safebooru_page)
+                    _safebooru_index = index
+                except Exception as e:
+                    logger.error(f"Error opening Safebooru index: {e}")
+    return _safebooru_index
+
+def fetch_image_from_safebooru():
+    """
+    Fetch a Miku image from Safebooru.
+    
+    Images are picked from the local Safebooru index once it has synced, so
+    posting doesn't wait on Safebooru and keeps working while it's down.
+    Until then, they come from an in-memory pool holding the rest of each
+    page, so most calls don't touch the network either.
+    
+    Returns:
+        Post: Contains image_url and source
+    """
+    index = get_safebooru_index()
+    if index is not None and len(index):
+        post = index.pick_unposted(filter_new_posts)
+        if post:
+            return post
+    return _safebooru_pool.take()
+
+def fetch_waifu_pics_batch():
+    """
+    Fetch a batch of anime images from waifu.pics' /many endpoint.
+    
+    Returns:
+        list: Post records for every returned image, or None on failure
     """
     try:
         # Note: waifu.pics doesn't allow specific character searches,
         # so this is only used as a last resort fallback
-        response = requests.get(WAIFU_PICS_API)
+        response = http_post(WAIFU_PICS_MANY_API, json={"exclude": []})
         if response.status_code == 200:
-            data = response.json()
-            return {
-                "image_url": data.get("url"),
-                "source": "waifu.pics (Fallback - may not be Miku)"
-            }
+            return [
+                Post(image_url=url, source="waifu.pics (Fallback - may not be Miku)")
+                for url in response.json().get("files", [])
+            ]
     except Exception as e:
         logger.error(f"Error fetching from waifu.pics: {e}")
     return None
 
-def fetch_image_from_waifu_im():
+def fetch_waifu_im_batch():
     """
-    Fetch a Nakano Miku image from waifu.im API.
+    Fetch a batch of Nakano Miku images from waifu.im.
     
     Returns:
-        dict: Contains image_url and source
+        list: Post records for every returned image, or None on failure
     """
     try:
         # Make sure we're specifically requesting Nakano Miku
@@ -75,63 +824,64 @@ def fetch_image_from_waifu_im():
             "height": ">=1000",  # Better quality images
             "many": "true"       # Get multiple results to choose from
         }
-        response = requests.get(ANIME_PICS_API, params=params)
+        # Results are random per call, so only reuse them if the server says so
+        response = cached_get(ANIME_PICS_API, params=params, default_ttl=0)
         if response.status_code == 200:
-            data = response.json()
-            if 'images' in data and len(data['images']) > 0:
-                # Choose a random image from the results
-                img = random.choice(data['images'])
-                return {
-                    "image_url": img.get("url"),
-                    "source": f"waifu.im - {img.get('source', 'Unknown')}"
-                }
+            return [
+                Post(
+                    image_url=img.get("url"),
+                    source=f"waifu.im - {img.get('source', 'Unknown')}"
+                )
+                for img in response.json().get("images", [])
+            ]
     except Exception as e:
         logger.error(f"Error fetching from waifu.im: {e}")
     return None
 
-def fetch_image_from_safebooru():
+# Both APIs return a different random selection on every call
+_waifu_pics_pool = CandidatePool("waifu_pics", fetch_waifu_pics_batch, max_batches=2)
+_waifu_im_pool = CandidatePool("waifu_im", fetch_waifu_im_batch, max_batches=2)
+
+def fetch_image_from_waifu_pics():
     """
-    Fetch a Miku image from Safebooru.
+    Fetch an anime image from waifu.pics API.
+    This is only used as a fallback since it's harder to get specific Miku images.
+    
+    Images come from a pool filled by the batch endpoint.
     
     Returns:
-        dict: Contains image_url and source
+        Post: Contains image_url and source
     """
-    try:
-        params = {"limit": 100}
-        response = requests.get(SAFEBOORU_API, params=params)
-        if response.status_code == 200:
-            posts = response.json()
-            if posts and len(posts) > 0:
-                # Select a random post
-                post = random.choice(posts)
-                # Safebooru image URL format
-                image_url = f"https://safebooru.org/images/{post['directory']}/{post['image']}"
-                return {
-                    "image_url": image_url,
-                    "source": f"Safebooru - Post #{post['id']}"
-                }
-    except Exception as e:
-        logger.error(f"Error fetching from Safebooru: {e}")
-    return None
+    return _waifu_pics_pool.take()
+
+def fetch_image_from_waifu_im():
+    """
+    Fetch a Nakano Miku image from waifu.im API.
+    
+    Images come from a pool holding every image of each batch response.
+    
+    Returns:
+        Post: Contains image_url and source
+    """
+    return _waifu_im_pool.take()
 
 def fetch_reddit_post():
     """
     Fetch a Nakano Miku-related post from Reddit.
     
     Returns:
-        dict: Contains image_url, caption, and source
+        Post: Contains image_url, caption, and source
     """
-    if not reddit_client:
+    if not get_reddit_client():
         logger.warning("Reddit client not initialized")
         return None
         
     try:
         # Pick a random Miku-related subreddit
         subreddit_name = random.choice(MIKU_SUBREDDITS)
-        subreddit = reddit_client.subreddit(subreddit_name)
         
         # Get hot posts from the subreddit
-        posts = list(subreddit.hot(limit=50))
+        posts = get_reddit_listing(subreddit_name, "hot", limit=50)
         
         # Only get image posts that are related to Miku
         image_posts = []
@@ -165,23 +915,222 @@ def fetch_reddit_post():
         # Pick a random image post
         post = random.choice(image_posts)
         
-        return {
-            "image_url": post.url,
-            "caption": post.title,
-            "source": f"Reddit r/{subreddit_name} - u/{post.author.name}"
-        }
+        return Post(
+            image_url=post.url,
+            caption=post.title,
+            source=f"Reddit r/{subreddit_name} - u/{post.author.name}"
+        )
         
     except Exception as e:
         logger.error(f"Error fetching from Reddit: {e}")
         return None
 
+# Pools that unused images from each pooled fetcher go back to
+_fetcher_pools = {
+    fetch_image_from_safebooru: _safebooru_pool,
+    fetch_image_from_waifu_im: _waifu_im_pool,
+    fetch_image_from_waifu_pics: _waifu_pics_pool,
+}
+
+def _return_unused(fetcher, result):
+    """
+    Put a new image that lost the race back into its fetcher's pool, so
+    it isn't lost with the rest of the concurrent fetches.
+    """
+    pool = _fetcher_pools.get(fetcher)
+    if pool is not None:
+        pool.put_back(result)
+
+def _return_when_done(fetcher, future):
+    # Done callback for fetches still running when another one won
+    if future.cancelled() or future.exception() is not None:
+        return
+    result, is_new = future.result()
+    if is_new:
+        _return_unused(fetcher, result)
+
+def _is_usable(result):
+    return bool(result) and 'image_url' in result
+
+def _is_new(result):
+    return not is_in_history("urls", result["image_url"], result)
+
+def _timed_fetch(fetcher):
+    """
+    Run a fetcher and record the outcome in its source's health stats.
+    A pooled source with nothing new counts as a duplicate rather than an
+    error, since it answered and only ran out of new images. The fetcher is
+    skipped if its circuit breaker no longer lets a request through, e.g.
+    when another fetch already took the half-open probe.
+    
+    Returns:
+        tuple: (usable result or None, True if it isn't in the post history)
+    """
+    health = source_health.get_source_health(fetcher.__name__)
+    if not health.allow_request():
+        return None, False
+        
+    started = time.perf_counter()
+    result, is_new, failed = None, False, False
+    try:
+        result = fetcher()
+        if _is_usable(result):
+            is_new = _is_new(result)
+        else:
+            result = None
+    except Exception as e:
+        logger.error(f"Error in {fetcher.__name__}: {e}")
+        result, failed = None, True
+        
+    latency = time.perf_counter() - started
+    metrics.observe(f"images.{fetcher.__name__}.seconds", latency)
+    pool = _fetcher_pools.get(fetcher)
+    if is_new:
+        outcome = source_health.OK
+    elif result or (pool is not None and not failed and not pool.failing):
+        outcome = source_health.DUPLICATE
+    else:
+        outcome = source_health.ERROR
+    health.record(outcome, latency)
+    return result, is_new
+
+def _order_fetchers(fetchers):
+    """
+    Returns:
+        list: The fetchers whose circuit breakers may allow a request,
+            weighted towards the sources quickest to produce a new image
+    """
+    by_name = {fetcher.__name__: fetcher for fetcher in fetchers}
+    return [by_name[name] for name in source_health.order_sources(list(by_name))]
+
+def _hedge_delay(fetcher):
+    """
+    Returns:
+        float: Seconds after which a fetcher counts as slow, or None when
+            hedging is disabled or there aren't enough samples yet
+    """
+    if IMAGE_HEDGE_PERCENTILE <= 0:
+        return None
+    return metrics.get_percentile(
+        f"images.{fetcher.__name__}.seconds", IMAGE_HEDGE_PERCENTILE, min_samples=HEDGE_MIN_SAMPLES
+    )
+
+def _fetch_sequentially(fetchers):
+    """
+    Returns:
+        tuple: (first new result, first usable result), either may be None
+    """
+    first_usable = None
+    for fetcher in fetchers:
+        result, is_new = _timed_fetch(fetcher)
+        if is_new:
+            return result, result
+        first_usable = first_usable or result
+    return None, first_usable
+
+def _fetch_concurrently(fetchers):
+    """
+    Query the fetchers in order, overlapping them only where one is slow,
+    and return as soon as one gives a new image.
+    
+    The first fetcher starts right away. The next one starts when every
+    running fetcher has answered without a new image, or when the last one
+    started runs past its hedge delay, so the weighted order decides which
+    source usually answers. Fetchers without a hedge delay yet don't hold
+    the next one back. Once all have started, one still running past its
+    hedge delay is started a second time and whichever copy answers first
+    counts. When several answer at once, the earliest in `fetchers` wins.
+    
+    Requests that are no longer needed are cancelled if they haven't
+    started, and otherwise left to finish in the background. New images
+    they or other finished fetchers return go back to their pool (see
+    _return_unused).
+    
+    Returns:
+        tuple: (first new result, first usable result), either may be None
+    """
+    started = time.perf_counter()
+    waiting = list(fetchers)
+    rank = {fetcher: index for index, fetcher in enumerate(fetchers)}
+    hedges = {fetcher: _hedge_delay(fetcher) for fetcher in fetchers}
+    started_at = {}  # fetcher -> seconds after `started` it was last started
+    pending = {}
+    first_usable = None
+    
+    def start(fetcher):
+        started_at[fetcher] = time.perf_counter() - started
+        pending[_fetch_pool.submit(_timed_fetch, fetcher)] = fetcher
+        
+    def start_next():
+        while waiting:
+            fetcher = waiting.pop(0)
+            start(fetcher)
+            if hedges[fetcher] is not None:
+                break
+                
+    try:
+        start_next()
+        while pending:
+            now = time.perf_counter() - started
+            due = [started_at[fetcher] + hedges[fetcher] for fetcher in set(pending.values())
+                   if hedges[fetcher] is not None]
+            timeout = max(0, min(due) - now) if due else None
+            
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            winner = None
+            for future in sorted(done, key=lambda future: rank[pending[future]]):
+                fetcher = pending.pop(future)
+                result, is_new = future.result()
+                if not is_new:
+                    first_usable = first_usable or result
+                elif winner is None:
+                    winner = result
+                else:
+                    _return_unused(fetcher, result)
+            if winner:
+                return winner, winner
+                
+            # Bring in the next source, or hedge one that is now slower than usual
+            now = time.perf_counter() - started
+            for fetcher in sorted(set(pending.values()), key=rank.get):
+                delay = hedges[fetcher]
+                if delay is None or now < started_at[fetcher] + delay:
+                    continue
+                hedges[fetcher] = None
+                if waiting:
+                    logger.debug(f"Image source {fetcher.__name__} is slow after {now:.2f}s, starting the next one")
+                    metrics.increment("images.staggered_requests")
+                    start_next()
+                else:
+                    logger.debug(f"Hedging slow image source {fetcher.__name__} after {now:.2f}s")
+                    metrics.increment("images.hedged_requests")
+                    start(fetcher)
+            if not pending:
+                start_next()
+        return None, first_usable
+    finally:
+        for future, fetcher in pending.items():
+            if not future.cancel():
+                future.add_done_callback(partial(_return_when_done, fetcher))
+
 def get_random_miku_image():
     """
     Try different sources to get a random Miku image.
     Prioritizes Miku-specific sources.
     
+    Sources whose circuit breaker is open are skipped, and the rest are
+    tried in an order weighted by how quickly each tends to produce a new
+    image (see source_health).
+    
+    In the default "concurrent" IMAGE_FETCH_MODE a primary source that is
+    slower than usual doesn't hold up the next one: they overlap, and the
+    first image that isn't already in the post history wins (see
+    _fetch_concurrently). The fallback source is only asked once every
+    primary source has answered without a usable image, in either mode.
+    
     Returns:
-        dict: Contains image_url and source
+        Post: Contains image_url and source. An image that was already posted
+            is only returned when no source had a new one.
     """
     # We now use a more sophisticated selection approach
     # that favors high-quality Miku-specific sources
@@ -197,20 +1146,25 @@ def get_random_miku_image():
         fetch_image_from_waifu_pics  # Generic anime images
     ]
     
-    # Try the primary sources first (with randomization for variety)
-    random.shuffle(primary_fetchers)
-    for fetcher in primary_fetchers:
-        result = fetcher()
-        if result and 'image_url' in result:
+    fetch = _fetch_concurrently if IMAGE_FETCH_MODE == "concurrent" else _fetch_sequentially
+    started = time.perf_counter()
+    try:
+        # Try the primary sources first (weighted by health, still randomized for variety)
+        result, usable = fetch(_order_fetchers(primary_fetchers))
+        if result:
             return result
-    
-    # If primary sources fail, try fallbacks
-    for fetcher in fallback_fetchers:
-        result = fetcher()
-        if result and 'image_url' in result:
+        if usable:
+            # A repeat Miku image beats a fallback that may not be Miku
+            return usable
+        
+        # If primary sources fail, try fallbacks
+        result, usable = fetch(_order_fetchers(fallback_fetchers))
+        if result or usable:
             logger.warning("Using fallback image source - may not be Miku")
-            return result
-    
-    # If all fetchers fail, return a default error response
-    logger.error("All image sources failed")
-    return None
+            return result or usable
+        
+        # If all fetchers fail, return a default error response
+        logger.error("All image sources failed")
+        return None
+    finally:
+        metrics.observe("images.selection.seconds", time.perf_counter() - started)
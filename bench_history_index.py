@@ -0,0 +1,123 @@
+"""
+Memory and lookup-time benchmark for the post history index.
+Compares the layouts the history has used: a list of strings per category,
+a dict keyed by the strings, and the PackedKeyTable of 64-bit keys the bot
+uses now. Each entry stores a raw and a normalized URL, so two keys. Every
+layout and size is measured in a fresh interpreter so RSS growth isn't
+muddied by earlier runs.
+
+RSS is read from /proc/self/statm, so this needs Linux.
+
+Usage: python bench_history_index.py [--sizes N ...] [--lookups N]
+"""
+import argparse
+import gc
+import json
+import os
+import subprocess
+import sys
+import time
+
+LAYOUTS = ("list", "dict", "packed")
+
+def current_rss():
+    """
+    Returns:
+        int: Resident set size of this process in bytes
+    """
+    with open("/proc/self/statm") as file:
+        return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+def entry_urls(number):
+    """
+    Returns:
+        tuple: (raw URL, normalized URL) of a made-up history entry
+    """
+    url = f"https://safebooru.org//images/{number // 1000}/{number:040x}.jpg?{number}"
+    return url, url.split("?")[0].lower()
+
+def build(layout, size):
+    """
+    Returns:
+        tuple: (index, lookup function taking an item and returning a bool)
+    """
+    if layout == "list":
+        index = []
+        for number in range(size):
+            index.extend(entry_urls(number))
+        return index, index.__contains__
+
+    if layout == "dict":
+        index = {}
+        now = time.time()
+        for number in range(size):
+            for url in entry_urls(number):
+                index[url] = now
+        return index, index.__contains__
+
+    from history_index import PackedKeyTable, item_key
+    index = PackedKeyTable()
+    now = time.time()
+    for number in range(size):
+        for url in entry_urls(number):
+            index.set(item_key(url), now)
+    return index, lambda item: index.get(item_key(item)) is not None
+
+def measure(layout, size, lookups):
+    """
+    Build one layout and time lookups against it, half hits and half misses.
+
+    Returns:
+        dict: RSS growth in bytes and mean lookup time in seconds
+    """
+    import history_index  # Imported before the baseline so it isn't counted
+    gc.collect()
+    baseline = current_rss()
+    index, contains = build(layout, size)
+    gc.collect()
+    rss = current_rss() - baseline
+
+    step = max(1, size // lookups)
+    items = [entry_urls(number)[number % 2] for number in range(0, size, step)][:lookups // 2]
+    items += [entry_urls(size + number)[0] for number in range(lookups - len(items))]
+    started = time.perf_counter()
+    for item in items:
+        contains(item)
+    elapsed = time.perf_counter() - started
+    return {"rss": rss, "lookup": elapsed / len(items)}
+
+def run_worker(layout, size, lookups):
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--worker", layout, str(size), str(lookups)],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    return json.loads(result.stdout)
+
+def format_time(seconds):
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.1f} ms"
+    return f"{seconds * 1e6:.2f} us"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000],
+                        help="history entries to index")
+    parser.add_argument("--lookups", type=int, default=400, help="lookups timed per layout")
+    parser.add_argument("--worker", nargs=3, metavar=("LAYOUT", "SIZE", "LOOKUPS"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        layout, size, lookups = args.worker
+        print(json.dumps(measure(layout, int(size), int(lookups))))
+        return
+
+    print(f"{'entries':>9}  {'layout':8} {'RSS':>10} {'lookup':>10}")
+    for size in args.sizes:
+        for layout in LAYOUTS:
+            result = run_worker(layout, size, args.lookups)
+            print(f"{size:>9}  {layout:8} {result['rss'] / 2**20:7.1f} MB {format_time(result['lookup']):>10}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Microbenchmark of Post records against plain content dicts.
+Times the scheduler's retry loop, where a freshly fetched image that isn't
+in the history is checked with is_in_history `--checks` times, and a whole
+post including the record_post write. Runs on a journal history in a
+temporary directory, so the bot's own history is never touched.
+
+Usage: python bench_post_record.py [--posts N] [--checks N]
+"""
+import argparse
+import os
+import tempfile
+import time
+import storage
+from history_backends import JournalBackend
+from storage import PostHistory, Post, record_post, is_in_history
+
+def make_content(number, as_post):
+    content = {
+        "image_url": f"https://safebooru.org//images/{number // 1000}/{number:040x}.jpg?{number}",
+        "caption": f"Nakano Miku fact number {number}!",
+        "source": f"Safebooru - Post #{number}"
+    }
+    return Post(**content) if as_post else content
+
+def bench(as_post, posts, checks):
+    """
+    Returns:
+        tuple: (seconds per is_in_history call, seconds per whole post)
+    """
+    check_time = 0
+    started = time.perf_counter()
+    for number in range(posts):
+        content = make_content(number, as_post)
+        check_started = time.perf_counter()
+        for _ in range(checks):
+            is_in_history("urls", content["image_url"], content)
+        check_time += time.perf_counter() - check_started
+        record_post(content)
+    total = time.perf_counter() - started
+    return check_time / (posts * checks), total / posts
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--posts", type=int, default=500, help="posts timed per content type")
+    parser.add_argument("--checks", type=int, default=15, help="is_in_history calls per post")
+    args = parser.parse_args()
+
+    for label, as_post in (("dict", False), ("Post", True)):
+        with tempfile.TemporaryDirectory() as directory:
+            history = PostHistory(
+                JournalBackend(
+                    snapshot_path=os.path.join(directory, "post_history.json"),
+                    journal_path=os.path.join(directory, "post_history.journal")
+                ),
+                bloom_path=os.path.join(directory, "post_history.bloom")
+            )
+            # record_post and is_in_history go through the shared instance
+            storage._post_history = history
+            check, post = bench(as_post, args.posts, args.checks)
+            history.close()
+            storage._post_history = None
+        print(f"{label:5} content: {check * 1e6:6.1f} us per is_in_history call, "
+              f"{post * 1e6:7.0f} us per post with record_post")
+
+if __name__ == "__main__":
+    main()
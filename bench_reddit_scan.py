@@ -0,0 +1,198 @@
+"""
+Wall-time benchmark of the parallel subreddit scans.
+Times get_batch_posts and initialize_last_post_ids (resuming from saved
+cursors) with one scan worker against REDDIT_SCAN_WORKERS of them, for a
+growing number of subreddits. Reddit is replaced by a local stand-in API
+that answers every listing after a fixed latency, and each run happens in
+a fresh interpreter in a temporary directory, so neither Reddit nor the
+bot's own history and tracker state are touched.
+
+Every subreddit has 30 posts, but only the last subreddit's are about Miku,
+so a batch has to walk every listing. Saved cursors sit 10 posts back.
+The Reddit rate limit is raised out of the way unless --rate is given.
+
+Usage: python bench_reddit_scan.py [--subreddits N ...] [--workers N] [--latency SECONDS] [--rate N]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+SCENARIOS = ("batch", "init")
+POSTS_PER_SUBREDDIT = 30
+# Index of the post each saved cursor points at
+CURSOR_INDEX = 19
+
+def base36(number):
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    encoded = ""
+    while number:
+        number, digit = divmod(number, 36)
+        encoded = digits[digit] + encoded
+    return encoded or "0"
+
+def make_posts(subreddits):
+    """
+    Returns:
+        list: Post data for the stand-in API, oldest first, with IDs
+            increasing like Reddit's
+    """
+    now = time.time()
+    posts = []
+    for index, subreddit in enumerate(subreddits):
+        title = "Nakano Miku" if index == len(subreddits) - 1 else "Cat picture"
+        for number in range(POSTS_PER_SUBREDDIT):
+            post_id = base36(36**5 + index * POSTS_PER_SUBREDDIT + number)
+            posts.append({
+                "id": post_id, "name": f"t3_{post_id}", "subreddit": subreddit, "title": title,
+                "url": f"https://i.redd.it/{post_id}.jpg", "created_utc": now - 7200 + number,
+                "author": "bench", "permalink": f"/r/{subreddit}/comments/{post_id}/"
+            })
+    return posts
+
+def start_standin(posts, latency):
+    """
+    Serve Reddit's OAuth token endpoint and /r/<subreddits>/<sort> listings
+    (with limit and before) on localhost, answering each GET after `latency`.
+
+    Returns:
+        tuple: (server, dict of request stats)
+    """
+    stats = {"gets": 0, "in_flight": 0, "max_in_flight": 0}
+    lock = threading.Lock()
+
+    class StandinHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def send_json(self, body):
+            data = json.dumps(body).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            self.send_json({"access_token": "bench", "token_type": "bearer", "expires_in": 3600, "scope": "*"})
+
+        def do_GET(self):
+            with lock:
+                stats["gets"] += 1
+                stats["in_flight"] += 1
+                stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+            time.sleep(latency)
+            url = urlsplit(self.path)
+            query = parse_qs(url.query)
+            names = {name.lower() for name in url.path.split("/")[2].split("+")}
+            limit = int(query.get("limit", ["25"])[0])
+            before = query.get("before", [None])[0]
+            listing = [post for post in reversed(posts) if post["subreddit"].lower() in names]
+            if before:
+                fullnames = [post["name"] for post in listing]
+                listing = listing[:fullnames.index(before)] if before in fullnames else []
+            children = [{"kind": "t3", "data": post} for post in listing[:limit]]
+            with lock:
+                stats["in_flight"] -= 1
+            self.send_json({"kind": "Listing", "data": {"children": children, "after": None, "before": None}})
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandinHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, stats
+
+def measure(scenario, count, latency):
+    """
+    Run one scenario in the current directory against a fresh stand-in.
+
+    Returns:
+        dict: Seconds taken, GETs made, most GETs in flight at once and a
+            digest of the result for comparing runs
+    """
+    subreddits = [f"benchsub{index}" for index in range(count)]
+    posts = make_posts(subreddits)
+    server, stats = start_standin(posts, latency)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    with open("praw.ini", "w") as file:
+        file.write(f"[DEFAULT]\noauth_url={base_url}\nreddit_url={base_url}\ncheck_for_updates=False\n")
+    if scenario == "init":
+        cursors = {post["subreddit"]: post["id"] for post in posts[CURSOR_INDEX::POSTS_PER_SUBREDDIT]}
+        with open("reddit_tracker_state.json", "w") as file:
+            json.dump({"last_post_ids": cursors}, file)
+
+    import config
+    config.MIKU_SUBREDDITS[:] = subreddits
+    import reddit_tracker
+    # Nothing has been posted yet
+    reddit_tracker.is_in_history = lambda *args, **kwargs: False
+    reddit_tracker.get_reddit_client()
+    reddit_tracker._tracking_initialized = scenario == "batch"
+    stats.update(gets=0, max_in_flight=0)
+
+    started = time.perf_counter()
+    if scenario == "batch":
+        result = [post["id"] for post in reddit_tracker.get_batch_posts(5)]
+    else:
+        reddit_tracker.initialize_last_post_ids()
+        result = [sorted(reddit_tracker.tracked_posts), sorted(reddit_tracker.last_post_ids.items())]
+    elapsed = time.perf_counter() - started
+    server.shutdown()
+    return {"seconds": elapsed, "gets": stats["gets"], "max_in_flight": stats["max_in_flight"],
+            "result": json.dumps(result)}
+
+def run_worker(scenario, count, workers, args):
+    env = dict(
+        os.environ,
+        PYTHONPATH=os.path.dirname(os.path.abspath(__file__)),
+        PRAW_ALLOW_ENDPOINT_OVERRIDE="1",
+        REDDIT_CLIENT_ID="bench",
+        REDDIT_CLIENT_SECRET="bench",
+        REDDIT_SCAN_WORKERS=str(workers),
+        REDDIT_MAX_REQUESTS_PER_MINUTE=str(args.rate),
+        REDDIT_REQUEST_BURST=str(args.rate)
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        result = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--latency", str(args.latency),
+             "--worker", scenario, str(count)],
+            capture_output=True, text=True, cwd=directory, env=env
+        )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--subreddits", type=int, nargs="+", default=[4, 16, 64], help="subreddits monitored")
+    parser.add_argument("--workers", type=int, default=8, help="scan workers for the parallel runs")
+    parser.add_argument("--latency", type=float, default=0.15, help="seconds the stand-in takes per listing")
+    parser.add_argument("--rate", type=int, default=100000, help="REDDIT_MAX_REQUESTS_PER_MINUTE and burst")
+    parser.add_argument("--worker", nargs=2, metavar=("SCENARIO", "SUBREDDITS"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        scenario, count = args.worker
+        print(json.dumps(measure(scenario, int(count), args.latency)))
+        return
+
+    print(f"{'scenario':8} {'subreddits':>10}  {'1 worker':>9}  {f'{args.workers} workers':>10}  "
+          f"{'GETs':>9}  {'in flight':>9}  same result")
+    for scenario in SCENARIOS:
+        for count in args.subreddits:
+            sequential = run_worker(scenario, count, 1, args)
+            parallel = run_worker(scenario, count, args.workers, args)
+            print(f"{scenario:8} {count:>10}  {sequential['seconds']:8.2f}s  {parallel['seconds']:9.2f}s  "
+                  f"{sequential['gets']:>4}/{parallel['gets']:<4}  {parallel['max_in_flight']:>9}  "
+                  f"{sequential['result'] == parallel['result']}")
+
+if __name__ == "__main__":
+    main()
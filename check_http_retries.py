@@ -0,0 +1,73 @@
+"""
+Check that a rate-limited server can't stall http_get.
+A local server answers every request with 429 and "Retry-After: 3600"; the
+call must still come back, with the 429 response, once the retries are used
+up, each retry sleeping at most HTTP_MAX_RETRY_AFTER.
+
+HTTP_MAX_RETRY_AFTER defaults to 1 second here so the check runs quickly;
+set it in the environment to check another value.
+
+Exits non-zero if the call takes longer than the retries allow.
+
+Usage: python check_http_retries.py [--retry-after SECONDS]
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+os.environ.setdefault("HTTP_MAX_RETRY_AFTER", "1")
+
+from api_clients import http_get
+from config import HTTP_MAX_RETRIES, HTTP_MAX_RETRY_AFTER
+
+# Allowance for the requests themselves on top of the capped sleeps
+SLACK = 1.0
+
+def start_server(retry_after):
+    """
+    Args:
+        retry_after (str): Retry-After header value sent with every 429
+
+    Returns:
+        tuple: (server, list counting the requests it answered)
+    """
+    requests_seen = []
+
+    class RateLimitedHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests_seen.append(self.path)
+            self.send_response(429)
+            self.send_header("Retry-After", retry_after)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RateLimitedHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, requests_seen
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--retry-after", default="3600", help="Retry-After header the server sends")
+    args = parser.parse_args()
+
+    server, requests_seen = start_server(args.retry_after)
+    url = f"http://127.0.0.1:{server.server_address[1]}/api"
+    started = time.perf_counter()
+    response = http_get(url)
+    elapsed = time.perf_counter() - started
+    server.shutdown()
+
+    limit = HTTP_MAX_RETRIES * HTTP_MAX_RETRY_AFTER + SLACK
+    print(f"Retry-After {args.retry_after}: status {response.status_code} after {len(requests_seen)} "
+          f"requests in {elapsed:.2f}s (limit {limit:.2f}s)")
+    ok = response.status_code == 429 and len(requests_seen) == HTTP_MAX_RETRIES + 1 and elapsed <= limit
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
@@ -16,11 +16,65 @@ MIKU_SUBREDDITS = [
     "Nakano_Miku"
 ]
 
+# Subreddit listings are cached and shared by fetch_reddit_post and the
+# Reddit tracker. Seconds a listing stays fresh, per sort:
+REDDIT_LISTING_TTL = {
+    "new": float(os.getenv("REDDIT_NEW_TTL", 60)),
+    "hot": float(os.getenv("REDDIT_HOT_TTL", 15 * 60)),
+    "top": float(os.getenv("REDDIT_TOP_TTL", 60 * 60)),
+}
+
+# Requests per minute the bot makes to Reddit across all its clients; Reddit
+# allows 100 on average. Up to REDDIT_REQUEST_BURST can go out at once.
+REDDIT_MAX_REQUESTS_PER_MINUTE = float(os.getenv("REDDIT_MAX_REQUESTS_PER_MINUTE", 60))
+REDDIT_REQUEST_BURST = int(os.getenv("REDDIT_REQUEST_BURST", 30))
+
+# Per-subreddit scans (batch posting, startup catch-up) run on up to
+# REDDIT_SCAN_WORKERS threads; subreddits not done within
+# REDDIT_SCAN_DEADLINE seconds are left out of that scan.
+REDDIT_SCAN_WORKERS = int(os.getenv("REDDIT_SCAN_WORKERS", 8))
+REDDIT_SCAN_DEADLINE = float(os.getenv("REDDIT_SCAN_DEADLINE", 30))
+
+# How new Reddit posts are picked up: "poll" (check_new_reddit_posts every
+# 2 minutes) or "stream" (a background worker following the subreddits'
+# submission stream, asking for new posts every REDDIT_STREAM_INTERVAL
+# seconds). In stream mode the polling job takes over whenever the stream
+# has gone REDDIT_STREAM_STALE_AFTER seconds without a successful request.
+REDDIT_INGESTION_MODE = os.getenv("REDDIT_INGESTION_MODE", "poll").lower()
+REDDIT_STREAM_INTERVAL = float(os.getenv("REDDIT_STREAM_INTERVAL", 15))
+REDDIT_STREAM_STALE_AFTER = float(os.getenv("REDDIT_STREAM_STALE_AFTER", 120))
+
+# Where the Reddit tracker keeps its per-subreddit cursors and queued posts,
+# so a restart picks up where it stopped. Set to an empty string to disable.
+REDDIT_TRACKER_STATE_FILE = os.getenv("REDDIT_TRACKER_STATE_FILE", "reddit_tracker_state.json")
+
+# Submissions get_batch_posts rejected (not a Miku image, or already posted)
+# are remembered, up to REDDIT_REJECTED_MAX_POSTS of them, for
+# REDDIT_REJECTED_TTL seconds so later batches skip them without checking again
+REDDIT_REJECTED_MAX_POSTS = int(os.getenv("REDDIT_REJECTED_MAX_POSTS", 5000))
+REDDIT_REJECTED_TTL = float(os.getenv("REDDIT_REJECTED_TTL", 7 * 24 * 60 * 60))
+
 # API endpoints for anime images
 WAIFU_PICS_API = "https://api.waifu.pics/sfw/waifu"
+# Batch endpoint: POST returns 30 image URLs at once
+WAIFU_PICS_MANY_API = "https://api.waifu.pics/many/sfw/waifu"
 ANIME_PICS_API = "https://api.waifu.im/search"
 # Use specifically nakano_miku tag to only get Miku from Quintessential Quintuplets
 SAFEBOORU_API = "https://safebooru.org/index.php?page=dapi&s=post&q=index&json=1&tags=nakano_miku+rating%3asafe"
+# Same query as XML without posts; its root element carries the total post count
+SAFEBOORU_COUNT_API = "https://safebooru.org/index.php?page=dapi&s=post&q=index&limit=0&tags=nakano_miku+rating%3asafe"
+SAFEBOORU_PAGE_SIZE = 100
+# Seconds before the Safebooru post count is fetched again
+SAFEBOORU_COUNT_TTL = float(os.getenv("SAFEBOORU_COUNT_TTL", 6 * 60 * 60))
+
+# Local index of Safebooru post metadata, synced in the background so image
+# posts can pick from it without calling Safebooru. Set SAFEBOORU_INDEX_FILE
+# to an empty string to disable it.
+SAFEBOORU_POSTS_API = "https://safebooru.org/index.php?page=dapi&s=post&q=index&json=1"
+SAFEBOORU_TAGS = "nakano_miku rating:safe"
+SAFEBOORU_INDEX_FILE = os.getenv("SAFEBOORU_INDEX_FILE", "safebooru_index.db")
+SAFEBOORU_SYNC_INTERVAL = float(os.getenv("SAFEBOORU_SYNC_INTERVAL", 30 * 60))  # seconds
+SAFEBOORU_SYNC_PAGE_DELAY = float(os.getenv("SAFEBOORU_SYNC_PAGE_DELAY", 1))  # seconds between pages
 
 # Scheduling intervals (in seconds)
 # These can be customized via environment variables
@@ -30,3 +84,72 @@ REDDIT_POST_INTERVAL = int(os.getenv("REDDIT_POST_INTERVAL", 60)) * 60  # Defaul
 
 # Paths for data storage
 HISTORY_FILE = "post_history.json"
+HISTORY_JOURNAL_FILE = "post_history.journal"
+HISTORY_BLOOM_FILE = "post_history.bloom"
+
+# Target false-positive rate of the Bloom filter checked before URL lookups
+BLOOM_FALSE_POSITIVE_RATE = float(os.getenv("BLOOM_FALSE_POSITIVE_RATE", 0.01))
+
+# Post history storage: "sqlite" (default), "postgres" or "json".
+# The SQL backends keep the full history; point HISTORY_DB_FILE at a persistent
+# volume (or use postgres) so history survives redeploys.
+HISTORY_BACKEND = os.getenv("HISTORY_BACKEND", "sqlite").lower()
+HISTORY_DB_FILE = os.getenv("HISTORY_DB_FILE", "post_history.db")
+HISTORY_DATABASE_URL = os.getenv("HISTORY_DATABASE_URL", os.getenv("DATABASE_URL", ""))
+
+# Days before an item may be posted again, per history category.
+# Categories that aren't listed (images, URLs, Reddit posts) are never reposted.
+REPOST_WINDOW_DAYS = {
+    "facts": float(os.getenv("FACT_REPOST_DAYS", 30)),
+}
+
+# Seconds between expiry passes while no history changes are being made
+HISTORY_EXPIRY_INTERVAL = float(os.getenv("HISTORY_EXPIRY_INTERVAL", 60))
+
+# Images whose perceptual fingerprints differ in at most this many of 64 bits
+# are treated as the same picture
+IMAGE_HASH_THRESHOLD = int(os.getenv("IMAGE_HASH_THRESHOLD", 5))
+
+# Journal size (in bytes) after which it is folded into a new history snapshot
+HISTORY_COMPACT_THRESHOLD = int(os.getenv("HISTORY_COMPACT_THRESHOLD", 256 * 1024))
+
+# Outbound HTTP: connect/read timeouts (seconds) and retries for the image APIs.
+# Retries back off exponentially (HTTP_BACKOFF_FACTOR * 2^n) with random jitter.
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 5))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", 15))
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", 3))
+HTTP_BACKOFF_FACTOR = float(os.getenv("HTTP_BACKOFF_FACTOR", 0.5))
+# Longest a server's Retry-After header may make a retry sleep (seconds); a longer
+# value is cut down to this rather than stalling the worker that made the request
+HTTP_MAX_RETRY_AFTER = float(os.getenv("HTTP_MAX_RETRY_AFTER", HTTP_CONNECT_TIMEOUT))
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", 10))
+# Response cache for source API listings: total body size kept (bytes), and
+# how long (seconds) to reuse responses whose server sends no Cache-Control
+HTTP_CACHE_MAX_BYTES = int(os.getenv("HTTP_CACHE_MAX_BYTES", 8 * 1024 * 1024))
+HTTP_CACHE_DEFAULT_TTL = float(os.getenv("HTTP_CACHE_DEFAULT_TTL", 60))
+
+# How get_random_miku_image queries the image APIs: "concurrent" (primary
+# sources overlap when one is slow, first new image wins) or "sequential"
+# (one at a time)
+IMAGE_FETCH_MODE = os.getenv("IMAGE_FETCH_MODE", "concurrent").lower()
+IMAGE_FETCH_WORKERS = int(os.getenv("IMAGE_FETCH_WORKERS", 8))
+# In concurrent mode, once a source is slower than this percentile of its
+# recent latencies the next source is started, or, if all have been, the
+# slow one gets a second (hedged) request. 0 starts all sources at once.
+IMAGE_HEDGE_PERCENTILE = float(os.getenv("IMAGE_HEDGE_PERCENTILE", 95))
+
+# Candidate pools keep the rest of each image API batch for later posts.
+# Candidates expire after IMAGE_POOL_TTL seconds; the pool refills in the
+# background below IMAGE_POOL_LOW_WATER, and waits IMAGE_POOL_EMPTY_RETRY
+# seconds before asking again after a batch with nothing new.
+IMAGE_POOL_TTL = float(os.getenv("IMAGE_POOL_TTL", 30 * 60))
+IMAGE_POOL_LOW_WATER = int(os.getenv("IMAGE_POOL_LOW_WATER", 10))
+IMAGE_POOL_EMPTY_RETRY = float(os.getenv("IMAGE_POOL_EMPTY_RETRY", 5 * 60))
+
+# Image source health: outcomes kept per source for its stats, errors in a
+# row that open its circuit breaker, and how long (seconds) the breaker stays
+# open before a probe request. The cooldown doubles after each failed probe.
+SOURCE_STATS_WINDOW = int(os.getenv("SOURCE_STATS_WINDOW", 100))
+SOURCE_FAILURE_THRESHOLD = int(os.getenv("SOURCE_FAILURE_THRESHOLD", 5))
+SOURCE_COOLDOWN = float(os.getenv("SOURCE_COOLDOWN", 60))
+SOURCE_MAX_COOLDOWN = float(os.getenv("SOURCE_MAX_COOLDOWN", 30 * 60))
@@ -54,6 +54,20 @@ class HealthCheckHandler(BaseHTTPRequestHandler):
             self.send_header('Content-Type', 'application/json')
             self.end_headers()
             self.wfile.write(json.dumps(response_data).encode())
+        elif self.path == '/metrics':
+            # Internal counters and gauges (history lookups, fetch stats, ...)
+            import metrics
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(json.dumps(metrics.snapshot()).encode())
+        elif self.path == '/api/sources':
+            # Image source health stats and circuit breaker states
+            import source_health
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(json.dumps(source_health.snapshot()).encode())
         else:
             # For any other path, return 404
             self.send_response(404)
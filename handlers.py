@@ -4,24 +4,39 @@ import tempfile
 import requests
 from telegram import Update, InputFile
 from config import DEFAULT_CHANNEL
+from api_clients import http_get
+from image_fingerprints import compute_image_fingerprint
+from storage import find_similar_image, add_to_history
 import sys
 
 logger = logging.getLogger(__name__)
 
+# Results of send_post
+SENT = "sent"
+DUPLICATE = "duplicate"
+FAILED = "failed"
+
 def send_post(context, content: dict):
     """
     Send a post to the target channel or chat.
     
     Args:
         context: The context from the scheduler
-        content: Dict containing 'image_url', 'caption', and 'source'
+        content: Dict containing 'image_url', 'caption', and 'source'.
+            When the image can be fingerprinted, 'image_fingerprint' is added
+            so it gets stored with the post.
+            
+    Returns:
+        str: SENT, DUPLICATE if the image looks like one already posted
+            (its URL is added to the history so it isn't picked again), or
+            FAILED. Only a SENT post should be recorded.
     """
     try:
         # Use DEFAULT_CHANNEL from config as channel username
         channel = DEFAULT_CHANNEL
         if not channel:
             logger.error("No channel username provided for posting! Set TELEGRAM_CHANNEL_USERNAME in environment variables.")
-            return
+            return FAILED
             
         # Make sure the channel name starts with @ if it doesn't already
         if not channel.startswith('@'):
@@ -42,7 +57,7 @@ def send_post(context, content: dict):
             
         if not bot:
             logger.error("Could not get bot instance!")
-            return
+            return FAILED
             
         try:
             # First download the image to a temporary file
@@ -52,31 +67,42 @@ def send_post(context, content: dict):
             # Create a temporary file
             temp_file = None
             try:
-                # Download the image
-                response = requests.get(image_url, stream=True, timeout=10)
-                response.raise_for_status()  # Raise error for bad status codes
-                
-                # Get file extension from content type if possible
-                content_type = response.headers.get('content-type', '')
-                extension = '.jpg'  # Default extension
-                if 'png' in content_type:
-                    extension = '.png'
-                elif 'gif' in content_type:
-                    extension = '.gif'
-                elif 'jpeg' in content_type or 'jpg' in content_type:
-                    extension = '.jpg'
-                
-                # Create a temporary file with the appropriate extension
-                fd, temp_file = tempfile.mkstemp(suffix=extension)
-                os.close(fd)  # Close the file descriptor
-                
-                # Write the image data to the temporary file
-                with open(temp_file, 'wb') as f:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        f.write(chunk)
+                # Download the image; closing the response returns its
+                # connection to the pool even if the download fails midway
+                with http_get(image_url, stream=True) as response:
+                    response.raise_for_status()  # Raise error for bad status codes
+                    
+                    # Get file extension from content type if possible
+                    content_type = response.headers.get('content-type', '')
+                    extension = '.jpg'  # Default extension
+                    if 'png' in content_type:
+                        extension = '.png'
+                    elif 'gif' in content_type:
+                        extension = '.gif'
+                    elif 'jpeg' in content_type or 'jpg' in content_type:
+                        extension = '.jpg'
+                    
+                    # Create a temporary file with the appropriate extension
+                    fd, temp_file = tempfile.mkstemp(suffix=extension)
+                    os.close(fd)  # Close the file descriptor
+                    
+                    # Write the image data to the temporary file
+                    with open(temp_file, 'wb') as f:
+                        for chunk in response.iter_content(chunk_size=8192):
+                            f.write(chunk)
                 
                 logger.info(f"Image downloaded successfully to: {temp_file}")
                 
+                # Skip images that look like one we've already posted
+                with open(temp_file, 'rb') as f:
+                    fingerprint = compute_image_fingerprint(f.read())
+                if fingerprint:
+                    if find_similar_image(fingerprint):
+                        logger.info(f"Skipping near-duplicate image: {image_url[:50]}...")
+                        add_to_history("urls", image_url)
+                        return DUPLICATE
+                    content['image_fingerprint'] = fingerprint
+                
                 # Send the image from the temporary file
                 with open(temp_file, 'rb') as photo_file:
                     bot.send_photo(
@@ -85,6 +111,7 @@ def send_post(context, content: dict):
                         caption=full_caption
                     )
                 logger.info(f"Successfully posted content to {channel}")
+                return SENT
                 
             except requests.exceptions.RequestException as req_err:
                 logger.error(f"Error downloading image: {req_err}")
@@ -96,6 +123,7 @@ def send_post(context, content: dict):
                     caption=full_caption
                 )
                 logger.info(f"Successfully posted content using direct URL to {channel}")
+                return SENT
                 
             finally:
                 # Clean up the temporary file
@@ -115,3 +143,4 @@ def send_post(context, content: dict):
         
     except Exception as e:
         logger.error(f"Error sending post: {e}")
+    return FAILED
@@ -0,0 +1,485 @@
+"""
+Persistence backends for the post history.
+The in-memory index in storage.py replays a backend at startup and hands it
+every change as a record: a dict mapping history categories to
+{item: posted_at} dicts. Older files may hold plain lists of items instead.
+"""
+import json
+import os
+import logging
+import threading
+import time
+import sqlite3
+from config import (
+    HISTORY_FILE, HISTORY_JOURNAL_FILE, HISTORY_COMPACT_THRESHOLD,
+    HISTORY_BACKEND, HISTORY_DB_FILE, HISTORY_DATABASE_URL
+)
+
+logger = logging.getLogger(__name__)
+
+def merge_records(records, repost_windows=None):
+    """
+    Fold records into a single history, dropping expired items.
+
+    When an item appears more than once, the latest posting time wins.
+    Plain lists of items, from files written before timestamps were tracked,
+    count as posted now.
+
+    Args:
+        records (iterable): Records in the order they were written
+        repost_windows (dict, optional): Repost window in seconds per category
+
+    Returns:
+        dict: Mapping of history category to {item: posted_at}
+    """
+    now = time.time()
+    history = {}
+    for record in records:
+        for category, items in record.items():
+            merged = history.setdefault(category, {})
+            if not isinstance(items, dict):
+                items = dict.fromkeys(items, now)
+            for item, posted_at in items.items():
+                if posted_at > merged.get(item, float('-inf')):
+                    merged[item] = posted_at
+
+    for category, window in (repost_windows or {}).items():
+        if category in history:
+            history[category] = {
+                item: posted_at
+                for item, posted_at in history[category].items()
+                if posted_at + window > now
+            }
+    return history
+
+def _drop_partial_line(path, chunk_size=4096):
+    """
+    Truncate a journal after its last complete line. A crash mid-append
+    leaves a line without its "\n", and a record appended after it would
+    end up on the same line and be unreadable too.
+
+    Args:
+        path (str): Journal file; nothing happens if it doesn't exist
+    """
+    if not os.path.exists(path):
+        return
+
+    with open(path, 'rb+') as file:
+        end = file.seek(0, os.SEEK_END)
+        keep = 0
+        position = end
+        while position > 0:
+            start = max(0, position - chunk_size)
+            file.seek(start)
+            newline = file.read(position - start).rfind(b"\n")
+            if newline != -1:
+                keep = start + newline + 1
+                break
+            position = start
+        if keep == end:
+            return
+        file.truncate(keep)
+        file.flush()
+        os.fsync(file.fileno())
+    logger.warning(f"Dropped a partial record ({end - keep} bytes) from the end of {path}")
+
+class JournalBackend:
+    """
+    Stores the history as a JSON snapshot plus an append-only journal.
+
+    Each record is appended to the journal as a single JSON line, so saving a
+    post costs the size of the record rather than the size of the history.
+    When the journal grows past the compaction threshold it is rotated out,
+    and a background thread merges it into a fresh snapshot. A crash while appending can
+    only leave a truncated last line. It is cut off before the journal is
+    appended to again, so it can't take the next record down with it.
+    """
+
+    def __init__(self, snapshot_path=HISTORY_FILE, journal_path=HISTORY_JOURNAL_FILE,
+                 compact_threshold=HISTORY_COMPACT_THRESHOLD):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path
+        self.rotated_path = journal_path + ".old"
+        self.compact_threshold = compact_threshold
+        self._journal = None
+        self._compaction_thread = None
+
+    def load(self):
+        """
+        Read the snapshot and replay the journals written after it.
+
+        Returns:
+            list: Records in the order they were written
+        """
+        records = []
+
+        if os.path.exists(self.snapshot_path):
+            try:
+                with open(self.snapshot_path, 'r') as file:
+                    records.append(json.load(file))
+            except Exception as e:
+                logger.error(f"Error loading post history snapshot: {e}")
+
+        # A rotated journal is only left behind if compaction didn't finish
+        for path in (self.rotated_path, self.journal_path):
+            records.extend(self._read_journal(path))
+
+        return records
+
+    def _read_journal(self, path):
+        records = []
+        if not os.path.exists(path):
+            return records
+
+        try:
+            with open(path, 'r') as file:
+                for line_number, line in enumerate(file, 1):
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        logger.warning(f"Skipping unreadable record {line_number} in {path}")
+        except Exception as e:
+            logger.error(f"Error reading post history journal {path}: {e}")
+
+        return records
+
+    def append(self, record):
+        """
+        Append a record to the journal and sync it to disk.
+
+        Args:
+            record (dict): Mapping of history category to {item: posted_at}
+        """
+        if self._journal is None:
+            _drop_partial_line(self.journal_path)
+            self._journal = open(self.journal_path, 'a')
+
+        self._journal.write(json.dumps(record, separators=(',', ':')) + "\n")
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+
+    def needs_compaction(self):
+        """
+        Returns:
+            bool: True if the journal is over the threshold and no compaction is running
+        """
+        if self._compaction_thread is not None and self._compaction_thread.is_alive():
+            return False
+        try:
+            return os.path.getsize(self.journal_path) >= self.compact_threshold
+        except OSError:
+            return False
+
+    def expire(self, category, posted_before):
+        """
+        Expired items are left in the files and dropped at the next compaction.
+        """
+        pass
+
+    def compact(self, repost_windows=None):
+        """
+        Rotate the journal and merge it into the snapshot in a background thread.
+
+        The caller must make sure no records are appended while this method runs.
+
+        Args:
+            repost_windows (dict, optional): Repost window in seconds per
+                category; expired items are left out of the new snapshot
+        """
+        self._close_journal()
+        self._rotate_journal()
+
+        self._compaction_thread = threading.Thread(
+            target=self._finish_compaction,
+            args=(repost_windows,),
+            name="history-compaction"
+        )
+        self._compaction_thread.daemon = True
+        self._compaction_thread.start()
+
+    def _rotate_journal(self):
+        if not os.path.exists(self.journal_path):
+            return
+
+        if os.path.exists(self.rotated_path):
+            # An earlier compaction didn't finish; keep its records too
+            _drop_partial_line(self.rotated_path)
+            with open(self.journal_path, 'r') as source, open(self.rotated_path, 'a') as target:
+                target.write(source.read())
+            os.remove(self.journal_path)
+        else:
+            os.replace(self.journal_path, self.rotated_path)
+
+    def _finish_compaction(self, repost_windows):
+        try:
+            records = []
+            if os.path.exists(self.snapshot_path):
+                with open(self.snapshot_path, 'r') as file:
+                    records.append(json.load(file))
+            records.extend(self._read_journal(self.rotated_path))
+
+            self._write_snapshot(merge_records(records, repost_windows))
+            if os.path.exists(self.rotated_path):
+                os.remove(self.rotated_path)
+            logger.info("Post history journal compacted")
+        except Exception as e:
+            logger.error(f"Error compacting post history: {e}")
+
+    def _wait_for_compaction(self):
+        if self._compaction_thread is not None:
+            self._compaction_thread.join()
+            self._compaction_thread = None
+
+    def rewrite(self, history):
+        """
+        Replace the stored history with `history` and clear the journals.
+
+        Args:
+            history (dict): The complete post history
+        """
+        self._wait_for_compaction()
+        self._close_journal()
+        self._write_snapshot(history)
+        for path in (self.rotated_path, self.journal_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _write_snapshot(self, history):
+        temp_path = self.snapshot_path + ".tmp"
+        with open(temp_path, 'w') as file:
+            json.dump(history, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, self.snapshot_path)
+
+    def _close_journal(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    def close(self):
+        """Close the journal file"""
+        self._close_journal()
+
+
+class SQLBackend:
+    """
+    Stores the history in SQLite or Postgres, one indexed table per category.
+
+    Only expired items are ever deleted, so history survives redeploys in
+    full as long as the database lives on a persistent volume or an external
+    server. The first time an empty database is opened, the JSON history is
+    imported into it.
+    """
+
+    def __init__(self, dialect="sqlite", database=HISTORY_DB_FILE, categories=()):
+        self.dialect = dialect
+        self._known_tables = set()
+
+        if dialect == "postgres":
+            try:
+                import psycopg2
+            except ImportError:
+                raise RuntimeError("psycopg2 is required for the postgres history backend")
+            self._connection = psycopg2.connect(database)
+            self._placeholder = "%s"
+            self._seq_column = "seq BIGSERIAL PRIMARY KEY"
+            self._time_column = "posted_at DOUBLE PRECISION NOT NULL"
+        else:
+            self._connection = sqlite3.connect(database, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._placeholder = "?"
+            self._seq_column = "seq INTEGER PRIMARY KEY AUTOINCREMENT"
+            self._time_column = "posted_at REAL NOT NULL"
+
+        cursor = self._connection.cursor()
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS history_meta ("
+            "name TEXT PRIMARY KEY, "
+            "value TEXT NOT NULL)"
+        )
+        for category in categories:
+            self._ensure_table(cursor, category)
+        self._connection.commit()
+
+    @staticmethod
+    def _table(category):
+        if not category.replace("_", "").isalnum():
+            raise ValueError(f"Invalid history category: {category}")
+        return f"history_{category}"
+
+    def _ensure_table(self, cursor, category):
+        table = self._table(category)
+        if table in self._known_tables:
+            return table
+
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            f"{self._seq_column}, "
+            f"item TEXT NOT NULL UNIQUE, "
+            f"{self._time_column})"
+        )
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {table}_posted_at ON {table} (posted_at)")
+        self._known_tables.add(table)
+        return table
+
+    def _stored_categories(self, cursor):
+        if self.dialect == "postgres":
+            cursor.execute(
+                "SELECT table_name FROM information_schema.tables "
+                "WHERE table_schema = current_schema() AND table_name LIKE 'history\\_%'"
+            )
+        else:
+            cursor.execute(
+                "SELECT name FROM sqlite_master "
+                "WHERE type = 'table' AND name LIKE 'history\\_%' ESCAPE '\\'"
+            )
+        tables = [row[0] for row in cursor.fetchall()]
+        return [table[len("history_"):] for table in tables if table != "history_meta"]
+
+    def load(self):
+        """
+        Read every stored item, importing the JSON history on first use.
+
+        Returns:
+            list: A single record holding the whole history, in insertion order
+        """
+        self.migrate_json_history()
+
+        cursor = self._connection.cursor()
+        record = {}
+        for category in self._stored_categories(cursor):
+            self._known_tables.add(self._table(category))
+            cursor.execute(f"SELECT item, posted_at FROM {self._table(category)} ORDER BY seq")
+            record[category] = dict(cursor.fetchall())
+        return [record]
+
+    def migrate_json_history(self, snapshot_path=HISTORY_FILE, journal_path=HISTORY_JOURNAL_FILE):
+        """
+        Import the JSON snapshot and journal once. Later calls do nothing.
+
+        Returns:
+            bool: True if a migration ran
+        """
+        cursor = self._connection.cursor()
+        cursor.execute(
+            f"SELECT value FROM history_meta WHERE name = {self._placeholder}",
+            ("json_migrated",)
+        )
+        if cursor.fetchone():
+            return False
+
+        # Entries saved before timestamps were tracked count as posted now
+        now = time.time()
+        records = JournalBackend(snapshot_path, journal_path).load()
+        for record in records:
+            self._insert(cursor, {
+                category: items if isinstance(items, dict) else dict.fromkeys(items, now)
+                for category, items in record.items()
+            })
+        cursor.execute(
+            f"INSERT INTO history_meta (name, value) VALUES ({self._placeholder}, {self._placeholder})",
+            ("json_migrated", snapshot_path)
+        )
+        self._connection.commit()
+
+        if records:
+            logger.info(f"Imported post history from {snapshot_path} into the {self.dialect} database")
+        return True
+
+    def _insert(self, cursor, record):
+        placeholder = self._placeholder
+        for category, items in record.items():
+            table = self._ensure_table(cursor, category)
+            cursor.executemany(
+                f"INSERT INTO {table} (item, posted_at) VALUES ({placeholder}, {placeholder}) "
+                f"ON CONFLICT (item) DO UPDATE SET posted_at = excluded.posted_at",
+                list(items.items())
+            )
+
+    def append(self, record):
+        """
+        Insert a record in its own transaction.
+
+        Args:
+            record (dict): Mapping of history category to {item: posted_at}
+        """
+        try:
+            self._insert(self._connection.cursor(), record)
+            self._connection.commit()
+        except Exception:
+            self._connection.rollback()
+            raise
+
+    def expire(self, category, posted_before):
+        """
+        Delete items of a category posted at or before the given time.
+
+        Args:
+            category (str): The history category
+            posted_before (float): Unix timestamp of the newest expired item
+        """
+        cursor = self._connection.cursor()
+        try:
+            cursor.execute(
+                f"DELETE FROM {self._ensure_table(cursor, category)} WHERE posted_at <= {self._placeholder}",
+                (posted_before,)
+            )
+            self._connection.commit()
+        except Exception:
+            self._connection.rollback()
+            raise
+
+    def needs_compaction(self):
+        """
+        Returns:
+            bool: Always False; the database manages its own storage
+        """
+        return False
+
+    def compact(self, repost_windows=None):
+        pass
+
+    def rewrite(self, history):
+        """
+        Replace the stored history with `history`.
+
+        Args:
+            history (dict): The complete post history
+        """
+        cursor = self._connection.cursor()
+        try:
+            for category in self._stored_categories(cursor):
+                cursor.execute(f"DELETE FROM {self._table(category)}")
+            self._insert(cursor, history)
+            self._connection.commit()
+        except Exception:
+            self._connection.rollback()
+            raise
+
+    def close(self):
+        """Close the database connection"""
+        self._connection.close()
+
+def create_history_backend(categories=()):
+    """
+    Create the history backend selected by HISTORY_BACKEND in config.py.
+
+    Args:
+        categories (iterable): Categories whose tables should exist up front
+
+    Returns:
+        JournalBackend or SQLBackend: The configured backend
+    """
+    if HISTORY_BACKEND == "json":
+        return JournalBackend()
+    if HISTORY_BACKEND == "postgres":
+        if not HISTORY_DATABASE_URL:
+            raise RuntimeError("HISTORY_DATABASE_URL must be set to use the postgres history backend")
+        return SQLBackend("postgres", HISTORY_DATABASE_URL, categories)
+    if HISTORY_BACKEND != "sqlite":
+        logger.warning(f"Unknown HISTORY_BACKEND '{HISTORY_BACKEND}', using sqlite")
+    return SQLBackend("sqlite", HISTORY_DB_FILE, categories)
@@ -0,0 +1,239 @@
+"""
+Compact in-memory index structures for the post history.
+History items are reduced to 64-bit keys so the index holds flat arrays of
+machine integers instead of one Python string per item.
+"""
+import hashlib
+import math
+import struct
+from array import array
+
+# Reserved key values marking free and deleted slots
+EMPTY = 0
+DELETED = 1
+
+def item_key(item):
+    """
+    Reduce a history item to a 64-bit key.
+
+    Args:
+        item (str): The history item (URL, hash, fact, ...)
+
+    Returns:
+        int: The key, never equal to EMPTY or DELETED
+    """
+    key = int.from_bytes(hashlib.blake2b(item.encode(), digest_size=8).digest(), 'big')
+    return key if key > DELETED else key + 2
+
+class PackedKeyTable:
+    """
+    Open-addressing hash table mapping 64-bit keys to float timestamps.
+
+    Keys and values live in two parallel `array` buffers (16 bytes per slot)
+    and are found by linear probing. The table doubles once it is 60% full,
+    counting deleted slots, which are dropped on resize.
+
+    Only one thread may modify the table, but any thread can read it without
+    locking: a resize builds new buffers and swaps them in with a single
+    assignment, and a new slot's value is written before its key.
+    """
+
+    MAX_LOAD = 0.6
+
+    def __init__(self, capacity=1024):
+        size = 8
+        while size * self.MAX_LOAD < capacity:
+            size *= 2
+        self._table = self._allocate(size)
+        self._size = 0
+        self._used = 0
+
+    @staticmethod
+    def _allocate(size):
+        return array('Q', [EMPTY]) * size, array('d', [0.0]) * size, size - 1
+
+    def __len__(self):
+        return self._size
+
+    @staticmethod
+    def _find_slot(table, key):
+        keys, values, mask = table
+        slot = key & mask
+        free = None
+        while True:
+            current = keys[slot]
+            if current == key:
+                return slot, True
+            if current == EMPTY:
+                return (slot if free is None else free), False
+            if current == DELETED and free is None:
+                free = slot
+            slot = (slot + 1) & mask
+
+    def get(self, key):
+        """
+        Args:
+            key (int): A key from item_key
+
+        Returns:
+            float: The stored value, or None if the key isn't present
+        """
+        keys, values, mask = self._table
+        slot = key & mask
+        while True:
+            current = keys[slot]
+            if current == key:
+                return values[slot]
+            if current == EMPTY:
+                return None
+            slot = (slot + 1) & mask
+
+    def set(self, key, value):
+        """
+        Store a value for a key, replacing any existing one.
+
+        Args:
+            key (int): A key from item_key
+            value (float): The value to store
+        """
+        table = self._table
+        keys, values, mask = table
+        slot, found = self._find_slot(table, key)
+        if found:
+            values[slot] = value
+            return
+
+        if keys[slot] == EMPTY:
+            self._used += 1
+        values[slot] = value
+        keys[slot] = key
+        self._size += 1
+
+        if self._used > (mask + 1) * self.MAX_LOAD:
+            self._resize()
+
+    def remove(self, key):
+        """
+        Args:
+            key (int): A key from item_key
+
+        Returns:
+            bool: True if the key was present
+        """
+        table = self._table
+        slot, found = self._find_slot(table, key)
+        if not found:
+            return False
+        table[0][slot] = DELETED
+        self._size -= 1
+        return True
+
+    def _resize(self):
+        old_keys, old_values, old_mask = self._table
+        # Double when mostly full of live keys; otherwise just drop deleted slots
+        size = old_mask + 1
+        while size * self.MAX_LOAD < self._size * 1.25:
+            size *= 2
+
+        table = self._allocate(size)
+        keys, values, mask = table
+        for key, value in zip(old_keys, old_values):
+            if key > DELETED:
+                slot, _ = self._find_slot(table, key)
+                values[slot] = value
+                keys[slot] = key
+
+        self._used = self._size
+        self._table = table
+
+    def keys(self):
+        """
+        Returns:
+            list: Every key currently stored
+        """
+        return [key for key in self._table[0] if key > DELETED]
+
+class BloomFilter:
+    """
+    Bloom filter over 64-bit keys from item_key.
+
+    A negative answer is definite, so lookups that miss can skip the exact
+    index. The bit array is sized for `capacity` keys at the requested
+    false-positive rate; the rate rises if more keys than that are added.
+    """
+
+    _HEADER = struct.Struct('<QIQQ')
+
+    def __init__(self, capacity, false_positive_rate):
+        capacity = max(1, capacity)
+        self.capacity = capacity
+        self.num_bits = max(8, math.ceil(-capacity * math.log(false_positive_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, key):
+        # Double hashing: the two halves of the key drive every probe
+        first = key & 0xFFFFFFFF
+        second = (key >> 32) | 1
+        return [(first + i * second) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, key):
+        """
+        Args:
+            key (int): A key from item_key
+        """
+        bits = self._bits
+        for position in self._positions(key):
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def might_contain(self, key):
+        """
+        Args:
+            key (int): A key from item_key
+
+        Returns:
+            bool: False if the key was definitely never added
+        """
+        bits = self._bits
+        for position in self._positions(key):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    @property
+    def expected_false_positive_rate(self):
+        """
+        Returns:
+            float: Estimated false-positive rate for the keys added so far
+        """
+        return (1 - math.exp(-self.num_hashes * self.count / self.num_bits)) ** self.num_hashes
+
+    def to_bytes(self):
+        """
+        Returns:
+            bytes: The filter's parameters followed by its bit array
+        """
+        header = self._HEADER.pack(self.num_bits, self.num_hashes, self.count, self.capacity)
+        return header + bytes(self._bits)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        Args:
+            data (bytes): Output of to_bytes
+
+        Returns:
+            BloomFilter: The restored filter
+        """
+        num_bits, num_hashes, count, capacity = cls._HEADER.unpack_from(data)
+        bloom = cls.__new__(cls)
+        bloom.capacity = capacity
+        bloom.num_bits = num_bits
+        bloom.num_hashes = num_hashes
+        bloom.count = count
+        bloom._bits = bytearray(data[cls._HEADER.size:cls._HEADER.size + (num_bits + 7) // 8])
+        if len(bloom._bits) != (num_bits + 7) // 8:
+            raise ValueError("Truncated Bloom filter data")
+        return bloom
@@ -0,0 +1,142 @@
+"""
+Perceptual image fingerprints for catching the same artwork under different URLs.
+Fingerprints are 64-bit difference hashes (dHash) stored as hex strings.
+"""
+import io
+import logging
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+HASH_BITS = 64
+
+def compute_image_fingerprint(image_bytes):
+    """
+    Compute the difference hash of an image.
+
+    The image is shrunk to 9x8 grayscale pixels and each bit records whether a
+    pixel is brighter than its right-hand neighbour, so re-encoding, resizing
+    and small edits barely change the result.
+
+    Args:
+        image_bytes (bytes): The raw image file contents
+
+    Returns:
+        str: 16-character hex fingerprint, or None if it couldn't be computed
+    """
+    if Image is None:
+        logger.debug("Pillow is not installed, skipping image fingerprint")
+        return None
+
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            pixels = list(image.convert("L").resize((9, 8), Image.LANCZOS).getdata())
+    except Exception as e:
+        logger.warning(f"Error computing image fingerprint: {e}")
+        return None
+
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            value = (value << 1) | (left > right)
+    return f"{value:016x}"
+
+def hamming_distance(first, second):
+    """
+    Args:
+        first (int): A fingerprint value
+        second (int): Another fingerprint value
+
+    Returns:
+        int: Number of bits that differ
+    """
+    return (first ^ second).bit_count()
+
+class HammingIndex:
+    """
+    Multi-index hash table for finding fingerprints within a Hamming distance.
+
+    Fingerprints are split into threshold + 1 disjoint bit segments, each with
+    its own lookup table. Two fingerprints within the threshold must agree
+    exactly on at least one segment, so a query only compares against the few
+    fingerprints sharing a segment value instead of scanning all of them.
+    """
+
+    def __init__(self, threshold):
+        self.threshold = max(0, min(threshold, HASH_BITS - 1))
+        segment_count = self.threshold + 1
+
+        # Spread the bits as evenly as possible across the segments
+        self._segments = []
+        start = 0
+        for i in range(segment_count):
+            width = HASH_BITS // segment_count + (1 if i < HASH_BITS % segment_count else 0)
+            self._segments.append((start, (1 << width) - 1))
+            start += width
+
+        self._tables = [{} for _ in self._segments]
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def _keys(self, value):
+        return [(value >> shift) & mask for shift, mask in self._segments]
+
+    def add(self, fingerprint):
+        """
+        Args:
+            fingerprint (str): Hex fingerprint to index
+        """
+        value = int(fingerprint, 16)
+        keys = self._keys(value)
+        if value in self._tables[0].get(keys[0], ()):
+            return
+        for table, key in zip(self._tables, keys):
+            table.setdefault(key, set()).add(value)
+        self._size += 1
+
+    def remove(self, fingerprint):
+        """
+        Args:
+            fingerprint (str): Hex fingerprint to drop from the index
+        """
+        value = int(fingerprint, 16)
+        keys = self._keys(value)
+        if value not in self._tables[0].get(keys[0], ()):
+            return
+        for table, key in zip(self._tables, keys):
+            bucket = table[key]
+            bucket.discard(value)
+            if not bucket:
+                del table[key]
+        self._size -= 1
+
+    def find(self, fingerprint):
+        """
+        Find an indexed fingerprint within the threshold distance.
+
+        Args:
+            fingerprint (str): Hex fingerprint to look up
+
+        Returns:
+            str: The closest matching fingerprint, or None if there isn't one
+        """
+        value = int(fingerprint, 16)
+        best = None
+        best_distance = self.threshold + 1
+        for table, key in zip(self._tables, self._keys(value)):
+            # Copy the bucket so a concurrent add can't change it mid-loop
+            for candidate in tuple(table.get(key, ())):
+                distance = hamming_distance(value, candidate)
+                if distance < best_distance:
+                    best, best_distance = candidate, distance
+                    if distance == 0:
+                        return f"{best:016x}"
+        return None if best is None else f"{best:016x}"
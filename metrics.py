@@ -0,0 +1,101 @@
+"""
+In-process counters, gauges and timings describing what the bot is doing
+internally. The health check servers expose a snapshot of them as JSON on /metrics.
+"""
+import threading
+from collections import deque
+
+# Number of recent observations kept per timing for percentiles
+TIMING_WINDOW = 1024
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_timings = {}
+
+def increment(name, amount=1):
+    """
+    Add to a counter, creating it at zero if needed.
+
+    Args:
+        name (str): Dotted metric name, e.g. 'history.bloom.checks'
+        amount (int): How much to add
+    """
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+def set_gauge(name, value):
+    """
+    Record the current value of a gauge.
+
+    Args:
+        name (str): Dotted metric name
+        value: The current value
+    """
+    with _lock:
+        _gauges[name] = value
+
+def observe(name, value):
+    """
+    Record one observation of a timing, e.g. a request's latency.
+
+    Args:
+        name (str): Dotted metric name, e.g. 'images.selection.seconds'
+        value (float): The observed value
+    """
+    with _lock:
+        samples = _timings.get(name)
+        if samples is None:
+            samples = _timings[name] = deque(maxlen=TIMING_WINDOW)
+        samples.append(value)
+
+def _percentile(ordered, percent):
+    index = min(len(ordered) - 1, int(len(ordered) * percent / 100))
+    return ordered[index]
+
+def get_percentile(name, percent, min_samples=1):
+    """
+    Args:
+        name (str): Timing name passed to observe
+        percent (float): Percentile between 0 and 100
+        min_samples (int): Fewest observations needed for a meaningful answer
+
+    Returns:
+        float: The percentile over recent observations, or None if there are
+            fewer than min_samples of them
+    """
+    with _lock:
+        samples = list(_timings.get(name, ()))
+    if not samples or len(samples) < min_samples:
+        return None
+    return _percentile(sorted(samples), percent)
+
+def get_counter(name):
+    """
+    Returns:
+        int: The counter's value, or 0 if it was never incremented
+    """
+    with _lock:
+        return _counters.get(name, 0)
+
+def snapshot():
+    """
+    Returns:
+        dict: Copies of all counters and gauges, plus p50/p99 of each timing
+    """
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        timings = {name: sorted(samples) for name, samples in _timings.items() if samples}
+    return {
+        "counters": counters,
+        "gauges": gauges,
+        "timings": {
+            name: {
+                "count": len(ordered),
+                "p50": _percentile(ordered, 50),
+                "p99": _percentile(ordered, 99)
+            }
+            for name, ordered in timings.items()
+        }
+    }
@@ -0,0 +1,137 @@
+"""
+Startup profile for every entry point of the bot.
+Runs each entry module's import under `python -X importtime` in a fresh
+interpreter, then times how long the scheduler takes to have its first
+jobs queued. Nothing is posted: the scheduler gets a stand-in updater.
+
+Usage: python profile_startup.py [--top N]
+"""
+import argparse
+import glob
+import os
+import subprocess
+import sys
+import time
+
+# Seconds before an import that hangs (e.g. on the network) is reported as such
+IMPORT_TIMEOUT = 60
+
+# Printed to stderr right before the entry import, so modules the interpreter
+# loaded at startup (site, .pth files) can be told apart
+MARKER = "--- entry import ---"
+
+FIRST_JOB_SCRIPT = """
+import time
+start = time.perf_counter()
+import scheduler
+
+class JobQueue:
+    def __init__(self):
+        self.jobs = []
+    def run_repeating(self, callback, interval, first=None, **kwargs):
+        self.jobs.append(callback.__name__)
+    def run_once(self, callback, when, **kwargs):
+        self.jobs.append(callback.__name__)
+
+class Updater:
+    job_queue = JobQueue()
+
+scheduler.setup_scheduler(Updater())
+print(time.perf_counter() - start, len(Updater.job_queue.jobs))
+"""
+
+def find_entry_points():
+    """
+    Returns:
+        list: Module names of the scripts meant to be run directly, plus the
+            modules gunicorn/Flask and the scheduler load
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    entry_points = {"main", "bot", "scheduler"}
+    for path in glob.glob(os.path.join(here, "*.py")):
+        name = os.path.splitext(os.path.basename(path))[0]
+        if name == "profile_startup":
+            continue
+        with open(path, encoding="utf-8") as f:
+            if "__main__" in f.read():
+                entry_points.add(name)
+    return sorted(entry_points)
+
+def profile_import(module, top):
+    """
+    Import a module in a fresh interpreter with -X importtime.
+
+    Returns:
+        tuple: (wall seconds, cumulative import microseconds of the module,
+            [(cumulative microseconds, package)] of its heaviest top-level imports),
+            or None if the import timed out
+    """
+    started = time.perf_counter()
+    try:
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c",
+             f"import sys; print({MARKER!r}, file=sys.stderr, flush=True); import {module}"],
+            capture_output=True, text=True, timeout=IMPORT_TIMEOUT,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        )
+    except subprocess.TimeoutExpired:
+        return None
+    wall = time.perf_counter() - started
+
+    total = 0
+    packages = {}
+    lines = result.stderr.splitlines()
+    if MARKER in lines:
+        lines = lines[lines.index(MARKER) + 1:]
+    for line in lines:
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        name = name[1:].rstrip()
+        if name.strip() == module:
+            total = max(total, int(cumulative))
+        elif name.startswith("  ") and not name.startswith("    "):
+            # The entry module's direct imports; deeper ones are in their parent's total
+            name = name.strip()
+            packages[name] = max(packages.get(name, 0), int(cumulative))
+    heaviest = sorted(((us, name) for name, us in packages.items()), reverse=True)[:top]
+    return wall, total, heaviest
+
+def time_to_first_job():
+    """
+    Returns:
+        tuple: (seconds from interpreter start to jobs being queued, job count)
+    """
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-c", FIRST_JOB_SCRIPT],
+        capture_output=True, text=True, timeout=IMPORT_TIMEOUT,
+        cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    wall = time.perf_counter() - started
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    in_process, jobs = result.stdout.split()[-2:]
+    return wall, float(in_process), int(jobs)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--top", type=int, default=3, help="heaviest imports to list per entry point")
+    args = parser.parse_args()
+
+    print(f"{'entry point':28} {'wall':>8} {'import':>9}  heaviest imports")
+    for module in find_entry_points():
+        profile = profile_import(module, args.top)
+        if profile is None:
+            print(f"{module:28} {'>' + str(IMPORT_TIMEOUT) + 's':>8}  import did not finish")
+            continue
+        wall, total, heaviest = profile
+        listed = ", ".join(f"{name} {us / 1000:.0f}ms" for us, name in heaviest)
+        print(f"{module:28} {wall * 1000:7.0f}ms {total / 1000:8.0f}ms  {listed}")
+
+    wall, in_process, jobs = time_to_first_job()
+    print(f"\nTime to first scheduled job: {wall * 1000:.0f}ms wall "
+          f"({in_process * 1000:.0f}ms import + setup_scheduler, {jobs} jobs queued)")
+
+if __name__ == "__main__":
+    main()
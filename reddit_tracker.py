@@ -2,11 +2,21 @@
 Reddit post tracker and batch posting functionality.
 Detects new posts from Miku-related subreddits and manages batched posting.
 """
+import json
 import logging
+import os
+import threading
 import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime
-from api_clients import reddit_client, MIKU_SUBREDDITS
-from storage import load_post_history, add_to_history, is_in_history
+from api_clients import get_reddit_client, get_reddit_listing, create_reddit_client, MIKU_SUBREDDITS
+from config import (
+    REDDIT_STREAM_INTERVAL, REDDIT_STREAM_STALE_AFTER, REDDIT_TRACKER_STATE_FILE,
+    REDDIT_REJECTED_MAX_POSTS, REDDIT_REJECTED_TTL, REDDIT_SCAN_WORKERS, REDDIT_SCAN_DEADLINE
+)
+from storage import is_in_history, Post
+import metrics
 
 logger = logging.getLogger(__name__)
 
@@ -19,27 +29,323 @@ tracked_posts = {}
 # How far back to look when searching for new posts (seconds)
 NEW_POST_LOOKBACK = 3600  # 1 hour
 
+# Newest posts considered per subreddit on each check
+NEW_POSTS_PER_SUBREDDIT = 10
+
+# Posts read from the combined listing of all subreddits on each check;
+# Reddit's maximum for a single listing request
+NEW_POSTS_LISTING_LIMIT = 100
+
+class RejectedPosts:
+    """
+    IDs of submissions get_batch_posts has rejected, so the hot and top
+    listings it scans every run don't go through is_miku_post and the
+    history again. Reddit titles and links can't be edited, so a rejection
+    stays valid; the TTL only makes room for listings to move on. Entries
+    are evicted least recently used first past `max_posts`.
+    
+    Expiry times are wall-clock timestamps so they survive being saved with
+    the tracker state.
+    """
+    
+    def __init__(self, max_posts=REDDIT_REJECTED_MAX_POSTS, ttl=REDDIT_REJECTED_TTL):
+        self.max_posts = max_posts
+        self.ttl = ttl
+        self._expires = OrderedDict()  # post ID -> expiry timestamp
+        self._lock = threading.Lock()
+        
+    def __len__(self):
+        return len(self._expires)
+        
+    def contains(self, post_id):
+        """
+        Args:
+            post_id (str): Submission ID
+            
+        Returns:
+            bool: True if the submission was rejected within the TTL
+        """
+        with self._lock:
+            expires = self._expires.get(post_id)
+            if expires is not None and expires <= time.time():
+                del self._expires[post_id]
+                expires = None
+            if expires is not None:
+                self._expires.move_to_end(post_id)
+        metrics.increment("reddit.rejected.hits" if expires is not None else "reddit.rejected.misses")
+        return expires is not None
+        
+    def add(self, post_id):
+        """
+        Args:
+            post_id (str): Submission ID to remember as rejected
+        """
+        with self._lock:
+            self._expires[post_id] = time.time() + self.ttl
+            self._expires.move_to_end(post_id)
+            while len(self._expires) > self.max_posts:
+                self._expires.popitem(last=False)
+            size = len(self._expires)
+        metrics.set_gauge("reddit.rejected.size", size)
+        
+    def to_dict(self):
+        """
+        Returns:
+            dict: Post ID -> expiry timestamp, least recently used first
+        """
+        with self._lock:
+            return dict(self._expires)
+            
+    def load(self, expires):
+        """
+        Args:
+            expires (dict): As returned by to_dict; expired entries are dropped
+        """
+        now = time.time()
+        with self._lock:
+            for post_id, expiry in expires.items():
+                if expiry > now:
+                    self._expires[post_id] = expiry
+            while len(self._expires) > self.max_posts:
+                self._expires.popitem(last=False)
+            size = len(self._expires)
+        metrics.set_gauge("reddit.rejected.size", size)
+
+# Submissions get_batch_posts has rejected
+rejected_posts = RejectedPosts()
+
+# Posts found while catching up after a restart, returned by the next
+# check_for_new_posts
+_caught_up_posts = []
+
+# Fullname of the newest submission the stream worker has seen
+_stream_cursor = None
+
+# Workers for per-subreddit scans. PRAW isn't thread-safe, so each worker
+# makes its requests with its own client.
+_scan_pool = ThreadPoolExecutor(max_workers=REDDIT_SCAN_WORKERS, thread_name_prefix="reddit-scan")
+_scan_clients = threading.local()
+
+# Set once initialize_last_post_ids has run
+_tracking_initialized = False
+_tracking_lock = threading.Lock()
+_state_lock = threading.Lock()
+
+def load_tracker_state():
+    """
+    Restore last_post_ids, tracked_posts, the rejected posts and the stream
+    cursor from REDDIT_TRACKER_STATE_FILE.
+    
+    Returns:
+        dict: The saved last_post_ids (empty if there was no saved state)
+    """
+    global _stream_cursor
+    
+    if not REDDIT_TRACKER_STATE_FILE or not os.path.exists(REDDIT_TRACKER_STATE_FILE):
+        return {}
+    try:
+        with open(REDDIT_TRACKER_STATE_FILE, 'r') as file:
+            state = json.load(file)
+    except Exception as e:
+        logger.error(f"Error loading Reddit tracker state: {e}")
+        return {}
+        
+    for post_id, post_data in state.get("tracked_posts", {}).items():
+        tracked_posts.setdefault(post_id, Post.from_dict(post_data))
+    rejected_posts.load(state.get("rejected_posts", {}))
+    _stream_cursor = state.get("stream_cursor")
+    saved_ids = state.get("last_post_ids", {})
+    logger.info(f"Restored Reddit tracker state: {len(saved_ids)} cursors, {len(tracked_posts)} tracked posts")
+    return saved_ids
+
+def save_tracker_state():
+    """
+    Write last_post_ids, tracked_posts, the rejected posts and the stream
+    cursor to REDDIT_TRACKER_STATE_FILE. The file is replaced atomically, so a crash
+    mid-write leaves the previous state intact.
+    """
+    if not REDDIT_TRACKER_STATE_FILE:
+        return
+    with _state_lock:
+        state = {
+            "last_post_ids": dict(last_post_ids),
+            "tracked_posts": {post_id: Post.from_dict(post_data).to_dict()
+                              for post_id, post_data in list(tracked_posts.items())},
+            "rejected_posts": rejected_posts.to_dict(),
+            "stream_cursor": _stream_cursor
+        }
+        try:
+            temp_path = REDDIT_TRACKER_STATE_FILE + ".tmp"
+            with open(temp_path, 'w') as file:
+                json.dump(state, file)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp_path, REDDIT_TRACKER_STATE_FILE)
+        except Exception as e:
+            logger.error(f"Error saving Reddit tracker state: {e}")
+
+def _scan_client():
+    # The calling scan worker's Reddit client, created on its first scan
+    client = getattr(_scan_clients, "reddit", None)
+    if client is None:
+        client = _scan_clients.reddit = create_reddit_client()
+    return client
+
+def scan_subreddits(scan, subreddit_names, description, deadline=REDDIT_SCAN_DEADLINE):
+    """
+    Run `scan` for each subreddit on the scan workers, which all draw on
+    the Reddit rate limit shared by every client.
+    
+    Args:
+        scan (callable): Takes a subreddit name and the worker's Reddit
+            client and returns that subreddit's result
+        subreddit_names (list): Subreddits to scan, in priority order
+        description (str): What the scan does, for log messages
+        deadline (float): Seconds to wait for the scans; subreddits not done
+            by then are left out
+            
+    Returns:
+        list: (subreddit name, result) of the scans that succeeded in time,
+            in subreddit_names order however they finished
+    """
+    started = time.perf_counter()
+    futures = [
+        (subreddit_name, _scan_pool.submit(lambda name: scan(name, _scan_client()), subreddit_name))
+        for subreddit_name in subreddit_names
+    ]
+    _, late = wait([future for _, future in futures], timeout=deadline)
+    
+    results = []
+    for subreddit_name, future in futures:
+        if future in late:
+            # Not started yet is dropped; already running finishes in the background
+            future.cancel()
+            metrics.increment("reddit.scan.timeouts")
+            logger.warning(f"Gave up {description} r/{subreddit_name} after {deadline}s")
+            continue
+        try:
+            results.append((subreddit_name, future.result()))
+        except Exception as e:
+            logger.error(f"Error {description} r/{subreddit_name}: {e}")
+    metrics.observe("reddit.scan.seconds", time.perf_counter() - started)
+    return results
+
+def catch_up_subreddit(subreddit_name, last_post_id, reddit_client=None):
+    """
+    Fetch only the posts made in a subreddit since `last_post_id`, using it
+    as the listing's `before` cursor.
+    
+    Reddit ignores a `before` cursor whose post was deleted and returns the
+    newest posts, so the listing is also read only down to the cursor:
+    iteration stops at the first post that isn't newer than it.
+    
+    Args:
+        subreddit_name (str): Subreddit to catch up on
+        last_post_id (str): ID of the newest post seen before the restart
+        reddit_client (praw.Reddit, optional): Client to fetch with;
+            defaults to the shared one
+        
+    Returns:
+        list: The posts newer than last_post_id, newest first
+    """
+    subreddit = (reddit_client or get_reddit_client()).subreddit(subreddit_name)
+    cursor = _id_value(last_post_id)
+    posts = []
+    for post in subreddit.new(limit=NEW_POSTS_LISTING_LIMIT, params={"before": f"t3_{last_post_id}"}):
+        if _id_value(post.id) <= cursor:
+            break
+        posts.append(post)
+    return posts
+
 def initialize_last_post_ids():
-    """Initialize last post IDs for all monitored subreddits"""
-    global last_post_ids
+    """
+    Initialize last post IDs for all monitored subreddits.
+    
+    Subreddits with a saved cursor catch up on the posts made since then;
+    the others start from their newest post. The subreddits are fetched in
+    parallel and processed in MIKU_SUBREDDITS order.
+    """
+    global last_post_ids, _tracking_initialized
     
-    if not reddit_client:
+    if not get_reddit_client():
         logger.warning("Reddit client not initialized. Can't track post IDs.")
         return
     
     try:
-        for subreddit_name in MIKU_SUBREDDITS:
+        saved_ids = load_tracker_state()
+        
+        # The combined listing usually has a recent post from every subreddit.
+        # It's cached, so the first check_for_new_posts can reuse it.
+        posts_by_subreddit = {}
+        if any(subreddit_name not in saved_ids for subreddit_name in MIKU_SUBREDDITS):
             try:
-                subreddit = reddit_client.subreddit(subreddit_name)
-                # Get most recent post to establish baseline
-                for post in subreddit.new(limit=1):
+                posts_by_subreddit = get_new_posts_by_subreddit()
+            except Exception as e:
+                logger.error(f"Error reading new posts of all subreddits: {e}")
+            
+        def fetch(subreddit_name, reddit_client):
+            if subreddit_name in saved_ids:
+                return catch_up_subreddit(subreddit_name, saved_ids[subreddit_name], reddit_client)
+            # Get most recent post to establish baseline, asking the
+            # subreddit itself if it had nothing in the combined listing
+            return (posts_by_subreddit.get(subreddit_name)
+                    or get_reddit_listing(subreddit_name, "new", limit=1, reddit_client=reddit_client))
+            
+        # Keep the saved cursors of subreddits whose catch-up fails or runs
+        # out of time, so checks still pick up from there
+        last_post_ids.update((name, saved_ids[name]) for name in MIKU_SUBREDDITS if name in saved_ids)
+        for subreddit_name, posts in scan_subreddits(fetch, MIKU_SUBREDDITS, "initializing tracking for"):
+            try:
+                if subreddit_name in saved_ids:
+                    caught_up = _process_new_posts(subreddit_name, posts, catching_up=True)
+                    _caught_up_posts.extend(caught_up)
+                    logger.info(f"Resumed tracking for r/{subreddit_name} from post ID: {saved_ids[subreddit_name]}, "
+                                f"{len(caught_up)} new Miku posts since")
+                    continue
+                    
+                for post in posts[:1]:
                     last_post_ids[subreddit_name] = post.id
                     logger.info(f"Initialized tracking for r/{subreddit_name} with post ID: {post.id}")
                     break
             except Exception as e:
                 logger.error(f"Error initializing tracking for r/{subreddit_name}: {e}")
+        _caught_up_posts.sort(key=lambda post: post.created_utc)
     except Exception as e:
         logger.error(f"Error in initialize_last_post_ids: {e}")
+    save_tracker_state()
+    _tracking_initialized = True
+
+def ensure_tracking_initialized():
+    """
+    Run initialize_last_post_ids unless it already has.
+    Nothing is fetched at import; the scheduler calls this from a job
+    shortly after startup, and check_for_new_posts as a fallback.
+    """
+    if _tracking_initialized:
+        return
+    with _tracking_lock:
+        if not _tracking_initialized:
+            initialize_last_post_ids()
+
+def make_post(post, subreddit_name):
+    """
+    Format a Reddit submission for sending.
+    
+    Args:
+        post: Reddit post object
+        subreddit_name: Name of the subreddit
+        
+    Returns:
+        Post: The post's image, title, attribution, ID and permalink
+    """
+    return Post(
+        image_url=post.url,
+        caption=post.title,
+        source=f"Reddit r/{subreddit_name} - u/{post.author.name}",
+        id=post.id,
+        permalink=post.permalink,
+        created_utc=post.created_utc
+    )
 
 def is_miku_post(post, subreddit_name):
     """
@@ -74,6 +380,81 @@ def is_miku_post(post, subreddit_name):
     
     return has_miku_reference
 
+def get_new_posts_by_subreddit():
+    """
+    Read the newest posts of all monitored subreddits with a single request
+    to their combined listing (r/a+b+c), split back out by subreddit.
+    
+    Returns:
+        dict: Subreddit name (as in MIKU_SUBREDDITS) -> its newest posts,
+            newest first, at most NEW_POSTS_PER_SUBREDDIT each
+    """
+    names = {name.lower(): name for name in MIKU_SUBREDDITS}
+    posts_by_subreddit = {name: [] for name in MIKU_SUBREDDITS}
+    for post in get_reddit_listing("+".join(MIKU_SUBREDDITS), "new", limit=NEW_POSTS_LISTING_LIMIT):
+        subreddit_name = names.get(post.subreddit.display_name.lower())
+        if subreddit_name is None:
+            continue
+        posts = posts_by_subreddit[subreddit_name]
+        if len(posts) < NEW_POSTS_PER_SUBREDDIT:
+            posts.append(post)
+    return posts_by_subreddit
+
+def _process_new_posts(subreddit_name, posts, catching_up=False):
+    """
+    Advance a subreddit's cursor past newly seen posts and track the Miku
+    posts among them that haven't been posted.
+    
+    Args:
+        subreddit_name (str): Subreddit the posts are from
+        posts (list): Posts newer than the subreddit's cursor, newest first
+        catching_up (bool): True for posts missed while the bot was down.
+            Those older than NEW_POST_LOOKBACK are still tracked for batch
+            posting, just not posted immediately.
+            
+    Returns:
+        list: Post records to post immediately
+    """
+    latest_posts = []
+    for post in posts:
+        # Check if this post is newer than our cutoff time
+        post_time = datetime.fromtimestamp(post.created_utc)
+        current_time = datetime.now()
+        time_diff = (current_time - post_time).total_seconds()
+        
+        if time_diff > NEW_POST_LOOKBACK and not catching_up:
+            # Skip posts older than our lookback period
+            continue
+        
+        latest_posts.append(post)
+    
+    # Process posts in chronological order (oldest first)
+    latest_posts.reverse()
+    
+    # Update the last seen post ID if we found new posts
+    if latest_posts:
+        last_post_ids[subreddit_name] = latest_posts[-1].id
+    
+    # Add Miku-related posts to the result list
+    new_posts = []
+    for post in latest_posts:
+        if is_miku_post(post, subreddit_name):
+            # Format the post for sending
+            post_data = make_post(post, subreddit_name)
+            
+            # Check if we've already posted this URL
+            if not is_in_history("urls", post.url):
+                # Add to tracked posts for potential batch posting
+                tracked_posts[post.id] = post_data
+                lag = time.time() - post.created_utc
+                if lag > NEW_POST_LOOKBACK:
+                    continue
+                if not catching_up:
+                    metrics.observe("reddit.poll.detection_lag_seconds", lag)
+                new_posts.append(post_data)
+                logger.info(f"New Miku post detected: {post.title[:30]}... in r/{subreddit_name}")
+    return new_posts
+
 def check_for_new_posts():
     """
     Check all monitored subreddits for new posts.
@@ -83,72 +464,156 @@ def check_for_new_posts():
     """
     global last_post_ids, tracked_posts
     
-    if not reddit_client:
+    if not get_reddit_client():
         logger.warning("Reddit client not initialized. Can't check for new posts.")
         return []
     
-    new_posts = []
+    ensure_tracking_initialized()
+    
+    # Posts found by the catch-up after a restart go out first
+    new_posts = _caught_up_posts[:]
+    del _caught_up_posts[:len(new_posts)]
+    cursors = dict(last_post_ids)
     
     try:
+        posts_by_subreddit = get_new_posts_by_subreddit()
+        
         for subreddit_name in MIKU_SUBREDDITS:
             try:
                 # Skip if we haven't initialized tracking for this subreddit
                 if subreddit_name not in last_post_ids:
                     continue
                 
-                subreddit = reddit_client.subreddit(subreddit_name)
-                
                 # Get new posts from the subreddit
                 latest_posts = []
-                for post in subreddit.new(limit=10):
+                for post in posts_by_subreddit[subreddit_name]:
                     # If we've seen this post before, we don't need to check older posts
                     if post.id == last_post_ids.get(subreddit_name):
                         break
-                    
-                    # Check if this post is newer than our cutoff time
-                    post_time = datetime.fromtimestamp(post.created_utc)
-                    current_time = datetime.now()
-                    time_diff = (current_time - post_time).total_seconds()
-                    
-                    if time_diff > NEW_POST_LOOKBACK:
-                        # Skip posts older than our lookback period
-                        continue
-                    
                     latest_posts.append(post)
                 
-                # Process posts in chronological order (oldest first)
-                latest_posts.reverse()
-                
-                # Update the last seen post ID if we found new posts
-                if latest_posts:
-                    last_post_ids[subreddit_name] = latest_posts[-1].id
-                
-                # Add Miku-related posts to the result list
-                for post in latest_posts:
-                    if is_miku_post(post, subreddit_name):
-                        # Format the post for sending
-                        post_data = {
-                            "image_url": post.url,
-                            "caption": post.title,
-                            "source": f"Reddit r/{subreddit_name} - u/{post.author.name}",
-                            "id": post.id,
-                            "permalink": post.permalink
-                        }
-                        
-                        # Check if we've already posted this URL
-                        if not is_in_history("urls", post.url):
-                            new_posts.append(post_data)
-                            # Add to tracked posts for potential batch posting
-                            tracked_posts[post.id] = post_data
-                            logger.info(f"New Miku post detected: {post.title[:30]}... in r/{subreddit_name}")
+                new_posts.extend(_process_new_posts(subreddit_name, latest_posts))
                 
             except Exception as e:
                 logger.error(f"Error checking r/{subreddit_name} for new posts: {e}")
     except Exception as e:
         logger.error(f"Error in check_for_new_posts: {e}")
     
+    if new_posts or last_post_ids != cursors:
+        save_tracker_state()
     return new_posts
 
+# Submission stream worker (REDDIT_INGESTION_MODE = "stream")
+_stream_thread = None
+_stream_lock = threading.Lock()
+# When the stream last completed a request
+_stream_heartbeat = None
+
+def start_stream(on_post, interval=REDDIT_STREAM_INTERVAL):
+    """
+    Follow the submission stream of all monitored subreddits in a daemon
+    thread, handing each new Miku post to `on_post` as soon as it's seen.
+    Does nothing if the thread is already running.
+    
+    Args:
+        on_post (callable): Called from the worker thread with each new Post
+        interval (float): Seconds to wait between stream requests
+    """
+    global _stream_thread
+    with _stream_lock:
+        if _stream_thread is not None:
+            return
+        _stream_thread = threading.Thread(
+            target=_run_stream, args=(on_post, interval),
+            name="reddit-stream", daemon=True
+        )
+    _stream_thread.start()
+
+def stream_is_healthy():
+    """
+    Returns:
+        bool: True if the stream worker made a successful request within
+            the last REDDIT_STREAM_STALE_AFTER seconds
+    """
+    heartbeat = _stream_heartbeat
+    return heartbeat is not None and time.monotonic() - heartbeat < REDDIT_STREAM_STALE_AFTER
+
+def _run_stream(on_post, interval):
+    """
+    Worker loop. With pause_after=-1 PRAW hands control back after every
+    response, so the worker paces its own requests and records a heartbeat.
+    The stream is (re)opened after the last submission it yielded, saved
+    with the tracker state, so nothing posted after an error or restart is
+    skipped.
+    """
+    global _stream_heartbeat, _stream_cursor
+    
+    # Restores the saved stream cursor, if there is one, and catches up on
+    # what the subreddits got while the bot was down
+    ensure_tracking_initialized()
+    while _caught_up_posts:
+        on_post(_caught_up_posts.pop(0))
+    
+    try:
+        reddit = create_reddit_client(requests_metric="reddit.stream.requests")
+    except Exception as e:
+        logger.error(f"Error creating Reddit client for the stream: {e}")
+        return
+    if not reddit:
+        logger.warning("Reddit client not initialized. Can't stream new posts.")
+        return
+        
+    names = {name.lower(): name for name in MIKU_SUBREDDITS}
+    retry_delay = interval
+    logger.info(f"Streaming new posts from r/{'+'.join(MIKU_SUBREDDITS)}")
+    while True:
+        try:
+            submissions = reddit.subreddit("+".join(MIKU_SUBREDDITS)).stream.submissions(
+                pause_after=-1,
+                # Without a saved cursor, start from the posts made after startup
+                skip_existing=_stream_cursor is None,
+                continue_after_id=_stream_cursor
+            )
+            for post in submissions:
+                if post is None:
+                    _stream_heartbeat = time.monotonic()
+                    retry_delay = interval
+                    time.sleep(interval)
+                    continue
+                # PRAW only applies continue_after_id to its first request, so
+                # older posts can come round again; Reddit IDs only increase
+                if _stream_cursor and _id_value(post.fullname) <= _id_value(_stream_cursor):
+                    continue
+                _stream_cursor = post.fullname
+                subreddit_name = names.get(post.subreddit.display_name.lower())
+                if subreddit_name is not None:
+                    _handle_stream_post(post, subreddit_name, on_post)
+                save_tracker_state()
+        except Exception as e:
+            logger.error(f"Error in Reddit submission stream: {e}")
+            metrics.increment("reddit.stream.errors")
+            time.sleep(retry_delay)
+            retry_delay = min(retry_delay * 2, 10 * 60)
+
+def _id_value(fullname):
+    # "t3_abc12" -> the base 36 ID as a number
+    return int(fullname.split("_", 1)[-1], 36)
+
+def _handle_stream_post(post, subreddit_name, on_post):
+    # Keep the polling cursor current so the fallback doesn't report it again
+    last_post_ids[subreddit_name] = post.id
+    lag = time.time() - post.created_utc
+    if lag > NEW_POST_LOOKBACK or post.id in tracked_posts:
+        return
+    if not is_miku_post(post, subreddit_name) or is_in_history("urls", post.url):
+        return
+        
+    metrics.observe("reddit.stream.detection_lag_seconds", lag)
+    post_data = make_post(post, subreddit_name)
+    tracked_posts[post.id] = post_data
+    logger.info(f"New Miku post streamed: {post.title[:30]}... in r/{subreddit_name}")
+    on_post(post_data)
+
 def get_batch_posts(max_posts=5):
     """
     Get a batch of unposted Miku content from all subreddits.
@@ -157,77 +622,99 @@ def get_batch_posts(max_posts=5):
         max_posts: Maximum number of posts to return
         
     Returns:
-        list: List of post data dictionaries
+        list: List of Post records
     """
-    if not reddit_client:
+    if not get_reddit_client():
         logger.warning("Reddit client not initialized. Can't get batch posts.")
         return []
     
+    ensure_tracking_initialized()
+    
     batch_posts = []
     posts_added = 0
     
     try:
         # First check for any new posts we're tracking
+        tracked_count = len(tracked_posts)
         for post_id, post_data in list(tracked_posts.items()):
+            if posts_added >= max_posts:
+                break
+                
+            # Remove from tracked posts so we don't check it again
+            # (it will be added to history after posting)
+            tracked_posts.pop(post_id, None)
+            
             if not is_in_history("urls", post_data["image_url"]):
                 batch_posts.append(post_data)
                 posts_added += 1
                 
-                # Remove from tracked posts so we don't check it again
-                # (it will be added to history after posting)
-                del tracked_posts[post_id]
-                
-                if posts_added >= max_posts:
-                    return batch_posts
+        if posts_added >= max_posts:
+            if len(tracked_posts) != tracked_count:
+                save_tracker_state()
+            return batch_posts
         
-        # If we still need more posts, check all subreddits for more content
-        for subreddit_name in MIKU_SUBREDDITS:
+        # If we still need more posts, check all subreddits for more content.
+        # They're scanned in parallel, each for as many posts as are still
+        # needed, and taken in MIKU_SUBREDDITS order so the batch is the one
+        # a scan of one subreddit after another would give.
+        needed = max_posts - posts_added
+        scans = scan_subreddits(
+            lambda subreddit_name, reddit_client: _scan_batch_candidates(subreddit_name, needed, reddit_client),
+            MIKU_SUBREDDITS, "getting batch posts from"
+        )
+        for subreddit_name, candidates in scans:
+            batch_posts.extend(candidates[:max_posts - posts_added])
+            posts_added = len(batch_posts)
             if posts_added >= max_posts:
                 break
                 
-            try:
-                subreddit = reddit_client.subreddit(subreddit_name)
-                
-                # Try hot posts first
-                for post in subreddit.hot(limit=25):
-                    if is_miku_post(post, subreddit_name) and not is_in_history("urls", post.url):
-                        post_data = {
-                            "image_url": post.url,
-                            "caption": post.title,
-                            "source": f"Reddit r/{subreddit_name} - u/{post.author.name}",
-                            "id": post.id,
-                            "permalink": post.permalink
-                        }
-                        batch_posts.append(post_data)
-                        posts_added += 1
-                        
-                        if posts_added >= max_posts:
-                            break
-                
-                # If we still need more, try top posts
-                if posts_added < max_posts:
-                    for post in subreddit.top(time_filter="week", limit=25):
-                        if is_miku_post(post, subreddit_name) and not is_in_history("urls", post.url):
-                            post_data = {
-                                "image_url": post.url,
-                                "caption": post.title,
-                                "source": f"Reddit r/{subreddit_name} - u/{post.author.name}",
-                                "id": post.id,
-                                "permalink": post.permalink
-                            }
-                            batch_posts.append(post_data)
-                            posts_added += 1
-                            
-                            if posts_added >= max_posts:
-                                break
-                
-            except Exception as e:
-                logger.error(f"Error getting batch posts from r/{subreddit_name}: {e}")
+        hits = metrics.get_counter("reddit.rejected.hits")
+        lookups = hits + metrics.get_counter("reddit.rejected.misses")
+        if lookups:
+            metrics.set_gauge("reddit.rejected.hit_rate", hits / lookups)
+        # Saves new rejections along with the tracked posts handed out above
+        save_tracker_state()
                 
     except Exception as e:
         logger.error(f"Error in get_batch_posts: {e}")
     
     return batch_posts
 
-# Initialize tracking when module is loaded
-initialize_last_post_ids()
\ No newline at end of file
+def _scan_batch_candidates(subreddit_name, max_posts, reddit_client):
+    """
+    Args:
+        subreddit_name (str): Subreddit to scan
+        max_posts (int): Candidates wanted
+        reddit_client (praw.Reddit): Client to fetch with
+        
+    Returns:
+        list: Up to max_posts Post records from the hot listing, then the
+            week's top listing if hot didn't have enough
+    """
+    candidates = []
+    for sort, time_filter in (("hot", None), ("top", "week")):
+        for post in get_reddit_listing(subreddit_name, sort, limit=25, time_filter=time_filter,
+                                       reddit_client=reddit_client):
+            post_data = _batch_candidate(post, subreddit_name)
+            if post_data:
+                candidates.append(post_data)
+                if len(candidates) >= max_posts:
+                    return candidates
+    return candidates
+
+def _batch_candidate(post, subreddit_name):
+    """
+    Args:
+        post: Reddit post object from a hot or top listing
+        subreddit_name (str): Subreddit the listing is from
+        
+    Returns:
+        Post: The post to include in a batch, or None if it's rejected
+    """
+    # Skip posts rejected before without looking at them again
+    if rejected_posts.contains(post.id):
+        return None
+    if not is_miku_post(post, subreddit_name) or is_in_history("urls", post.url):
+        rejected_posts.add(post.id)
+        return None
+    return make_post(post, subreddit_name)
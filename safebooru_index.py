@@ -0,0 +1,254 @@
+"""
+Local mirror of Safebooru post metadata for the Miku tags.
+A background thread keeps the SQLite index in sync with Safebooru, so images
+can be picked with a local query instead of an API call at post time.
+"""
+import logging
+import random
+import sqlite3
+import threading
+import time
+from config import (
+    SAFEBOORU_INDEX_FILE, SAFEBOORU_TAGS, SAFEBOORU_PAGE_SIZE,
+    SAFEBOORU_SYNC_INTERVAL, SAFEBOORU_SYNC_PAGE_DELAY
+)
+from storage import Post
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Metadata mirrored for each post, in column order
+POST_COLUMNS = ("id", "directory", "image", "tags", "width", "height", "score")
+
+class SafebooruIndex:
+    """
+    SQLite index of Safebooru posts matching SAFEBOORU_TAGS.
+
+    Syncing walks new posts downwards from the newest one with `id:>cursor`
+    and `id:<floor` tag filters, where `cursor` is the newest post of the
+    last finished sync and `floor` the oldest post stored by the current
+    one. Unlike page numbers, these filters don't shift when posts are
+    added mid-walk. The walk's progress is committed with every page, so an
+    interrupted sync resumes where it stopped and the initial full crawl
+    only happens once.
+
+    Posts found in the post history are flagged as posted, and a partial
+    index over the unposted ones keeps picking a candidate to a few
+    indexed lookups however much has been posted.
+    """
+
+    def __init__(self, path=SAFEBOORU_INDEX_FILE, tags=SAFEBOORU_TAGS):
+        """
+        Args:
+            path (str): SQLite database file
+            tags (str): Safebooru tag query the index mirrors
+        """
+        self.tags = tags
+        self._lock = threading.Lock()
+        self._sync_thread = None
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        # The index can always be re-synced, so don't fsync every commit
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS posts ("
+            "id INTEGER PRIMARY KEY, "
+            "directory TEXT NOT NULL, "
+            "image TEXT NOT NULL, "
+            "tags TEXT NOT NULL DEFAULT '', "
+            "width INTEGER, "
+            "height INTEGER, "
+            "score INTEGER, "
+            "posted INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS posts_unposted ON posts (id) WHERE posted = 0"
+        )
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS sync_state ("
+            "name TEXT PRIMARY KEY, "
+            "value INTEGER NOT NULL)"
+        )
+        self._connection.commit()
+        self._count = self._query_one("SELECT COUNT(*) FROM posts")
+        metrics.set_gauge("safebooru_index.posts", self._count)
+
+    def __len__(self):
+        return self._count
+
+    def _query_one(self, sql, params=()):
+        return self._connection.execute(sql, params).fetchone()[0]
+
+    def _get_state(self, name):
+        row = self._connection.execute("SELECT value FROM sync_state WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else 0
+
+    def _set_state(self, name, value):
+        self._connection.execute(
+            "INSERT INTO sync_state (name, value) VALUES (?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET value = excluded.value",
+            (name, value)
+        )
+
+    def sync_step(self, fetch_page):
+        """
+        Fetch and store one page of posts newer than the sync cursor.
+
+        Args:
+            fetch_page (callable): Takes a tag query and returns the newest
+                SAFEBOORU_PAGE_SIZE matching posts as dicts, or None on failure
+
+        Returns:
+            bool: True if there may be more pages to fetch
+        """
+        with self._lock:
+            cursor = self._get_state("cursor")
+            floor = self._get_state("walk_floor")
+        query = f"{self.tags} id:>{cursor}"
+        if floor:
+            query += f" id:<{floor}"
+
+        posts = fetch_page(query)
+        metrics.increment("safebooru_index.sync_requests")
+        if posts is None:
+            return False
+
+        with self._lock:
+            try:
+                if posts:
+                    self._connection.executemany(
+                        "INSERT INTO posts (id, directory, image, tags, width, height, score) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                        "ON CONFLICT (id) DO UPDATE SET directory = excluded.directory, "
+                        "image = excluded.image, tags = excluded.tags, width = excluded.width, "
+                        "height = excluded.height, score = excluded.score",
+                        [tuple(post.get(column) for column in POST_COLUMNS) for post in posts]
+                    )
+                    ids = [int(post["id"]) for post in posts]
+                    self._set_state("walk_top", max(max(ids), self._get_state("walk_top")))
+                    self._set_state("walk_floor", min(ids))
+                finished = len(posts) < SAFEBOORU_PAGE_SIZE
+                if finished:
+                    # Walked down to the cursor: everything newer is stored
+                    self._set_state("cursor", max(cursor, self._get_state("walk_top")))
+                    self._set_state("walk_top", 0)
+                    self._set_state("walk_floor", 0)
+                self._connection.commit()
+            except Exception:
+                self._connection.rollback()
+                raise
+            self._count = self._query_one("SELECT COUNT(*) FROM posts")
+
+        metrics.increment("safebooru_index.synced_posts", len(posts))
+        metrics.set_gauge("safebooru_index.posts", self._count)
+        return not finished
+
+    def sync(self, fetch_page, page_delay=SAFEBOORU_SYNC_PAGE_DELAY):
+        """
+        Fetch pages until the index holds every post newer than the cursor.
+
+        Args:
+            fetch_page (callable): See sync_step
+            page_delay (float): Seconds to wait between page requests
+
+        Returns:
+            int: Number of posts in the index afterwards
+        """
+        while self.sync_step(fetch_page):
+            time.sleep(page_delay)
+        return self._count
+
+    def start_sync(self, fetch_page, interval=SAFEBOORU_SYNC_INTERVAL):
+        """
+        Sync in a daemon thread now and then every `interval` seconds.
+        Does nothing if the thread is already running.
+
+        Args:
+            fetch_page (callable): See sync_step
+            interval (float): Seconds between syncs
+        """
+        with self._lock:
+            if self._sync_thread is not None:
+                return
+            self._sync_thread = threading.Thread(
+                target=self._run_sync, args=(fetch_page, interval),
+                name="safebooru-sync", daemon=True
+            )
+        self._sync_thread.start()
+
+    def _run_sync(self, fetch_page, interval):
+        while True:
+            try:
+                count = self.sync(fetch_page)
+                logger.info(f"Safebooru index synced, {count} posts indexed")
+            except Exception as e:
+                logger.error(f"Error syncing Safebooru index: {e}")
+            time.sleep(interval)
+
+    def _unposted_from(self, start_id, limit):
+        rows = self._connection.execute(
+            "SELECT id, directory, image FROM posts WHERE posted = 0 AND id >= ? ORDER BY id LIMIT ?",
+            (start_id, limit)
+        ).fetchall()
+        if len(rows) < limit:
+            # Wrap around to the oldest posts
+            rows += self._connection.execute(
+                "SELECT id, directory, image FROM posts WHERE posted = 0 AND id < ? ORDER BY id LIMIT ?",
+                (start_id, limit - len(rows))
+            ).fetchall()
+        return rows
+
+    def pick_unposted(self, filter_new, batch_size=20, attempts=5):
+        """
+        Pick a random indexed post whose image isn't in the post history.
+
+        Starting from a random ID, a batch of unposted rows is read and
+        checked against the history in random order until a new one turns
+        up; rows found in the history are flagged as posted so later picks
+        skip them.
+
+        Args:
+            filter_new (callable): Takes a list of Posts and returns those
+                that haven't been posted
+            batch_size (int): Rows to read per attempt
+            attempts (int): Batches to try before giving up
+
+        Returns:
+            Post: A new image, or None if none was found
+        """
+        started = time.perf_counter()
+        posted_ids = []
+        try:
+            for _ in range(attempts):
+                with self._lock:
+                    # Separate subqueries so each is a single rowid lookup
+                    lowest, highest = self._connection.execute(
+                        "SELECT (SELECT MIN(id) FROM posts), (SELECT MAX(id) FROM posts)"
+                    ).fetchone()
+                    if lowest is None:
+                        return None
+                    rows = self._unposted_from(random.randint(lowest, highest), batch_size)
+                if not rows:
+                    return None
+
+                random.shuffle(rows)
+                for post_id, directory, image in rows:
+                    post = Post(
+                        image_url=f"https://safebooru.org/images/{directory}/{image}",
+                        source=f"Safebooru - Post #{post_id}"
+                    )
+                    if filter_new([post]):
+                        return post
+                    posted_ids.append((post_id,))
+            return None
+        finally:
+            if posted_ids:
+                with self._lock:
+                    self._connection.executemany("UPDATE posts SET posted = 1 WHERE id = ?", posted_ids)
+                    self._connection.commit()
+            metrics.observe("safebooru_index.pick.seconds", time.perf_counter() - started)
+
+    def close(self):
+        """Close the database connection"""
+        with self._lock:
+            self._connection.close()
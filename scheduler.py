@@ -4,15 +4,133 @@ import time
 from telegram.ext import Updater
 from api_clients import get_random_miku_image, fetch_reddit_post
 from facts import get_random_miku_fact, get_random_miku_caption
-from handlers import send_post
-from storage import add_to_history, is_in_history
+from handlers import send_post, SENT, FAILED
+from storage import is_in_history, record_post, Post
 from config import (
-    MAIN_POST_INTERVAL, IMAGE_POST_INTERVAL, REDDIT_POST_INTERVAL
+    MAIN_POST_INTERVAL, IMAGE_POST_INTERVAL, REDDIT_POST_INTERVAL, REDDIT_INGESTION_MODE
 )
-from reddit_tracker import check_for_new_posts, get_batch_posts, initialize_last_post_ids
+from reddit_tracker import (
+    check_for_new_posts, get_batch_posts, ensure_tracking_initialized,
+    start_stream, stream_is_healthy
+)
+import metrics
 
 logger = logging.getLogger(__name__)
 
+# Other images tried when send_post finds the chosen one is a near-duplicate
+NEAR_DUPLICATE_RETRIES = 3
+
+def _fetch_image():
+    """
+    get_random_miku_image, counted towards the fetches-per-post metric.
+    """
+    metrics.increment("scheduler.image_fetches")
+    return get_random_miku_image()
+
+def _record_image_selection(exhausted):
+    """
+    Track how often the dedupe retry loops run out of attempts.
+    
+    Args:
+        exhausted (bool): True if no new image was found and the post was skipped
+    """
+    metrics.increment("scheduler.image_selections")
+    if exhausted:
+        metrics.increment("scheduler.dedupe_exhausted")
+    else:
+        metrics.increment("scheduler.image_posts")
+        
+    selections = metrics.get_counter("scheduler.image_selections")
+    posts = metrics.get_counter("scheduler.image_posts")
+    metrics.set_gauge("scheduler.dedupe_exhaustion_rate",
+                      metrics.get_counter("scheduler.dedupe_exhausted") / selections)
+    if posts:
+        metrics.set_gauge("scheduler.fetches_per_post",
+                          metrics.get_counter("scheduler.image_fetches") / posts)
+
+def _find_new_image(caption, max_attempts=15):
+    """
+    Fetch images until one isn't in the history.
+    
+    Args:
+        caption (str): Caption for the post
+        max_attempts (int): Extra fetches allowed after the first one
+        
+    Returns:
+        tuple: (Post with the image and caption, or None if no new image
+            was found, number of extra fetches made)
+    """
+    # Get a random image
+    image_data = _fetch_image()
+    if not image_data:
+        logger.error("Failed to get a Miku image")
+        return None, 0
+        
+    image_url = image_data["image_url"]
+    
+    # Create the content package for checking
+    content = Post(
+        image_url=image_url,
+        caption=caption,
+        source=image_data.get("source", "")
+    )
+    
+    # Check if this content is already in history (using enhanced deduplication)
+    content_attempts = 0
+    while is_in_history("urls", image_url, content) and content_attempts < max_attempts:
+        # Try to get a new image
+        image_data = _fetch_image()
+        if not image_data:
+            logger.error("Failed to get a unique Miku image after multiple attempts")
+            break
+            
+        image_url = image_data["image_url"]
+        content = Post(
+            image_url=image_url,
+            caption=caption,
+            source=image_data.get("source", "")
+        )
+        content_attempts += 1
+        
+    # If we still have a duplicate after many attempts, log and skip
+    if is_in_history("urls", image_url, content):
+        logger.warning("Could not create unique content after multiple attempts. Skipping post.")
+        return None, content_attempts
+    return content, content_attempts
+
+def _send_new_image(context, caption, kind):
+    """
+    Send a new image with the caption. If send_post finds the image looks
+    like one already posted, another image is fetched, up to
+    NEAR_DUPLICATE_RETRIES times.
+    
+    Args:
+        context: Telegram context
+        caption (str): Caption for the post
+        kind (str): "fact" or "image", for log messages
+        
+    Returns:
+        Post: The content that was sent, or None if nothing was
+    """
+    for _ in range(NEAR_DUPLICATE_RETRIES + 1):
+        content, content_attempts = _find_new_image(caption)
+        if content is None:
+            _record_image_selection(exhausted=True)
+            return None
+            
+        # Log that we're sending non-duplicate content
+        logger.info(f"Sending {kind} post with unique content (attempts: {content_attempts})")
+        
+        result = send_post(context, content)
+        if result == SENT:
+            _record_image_selection(exhausted=False)
+            return content
+        if result == FAILED:
+            return None
+        logger.info(f"Image for {kind} post was a near-duplicate, trying another")
+    _record_image_selection(exhausted=True)
+    return None
+
 def post_miku_fact(context):
     """
     Scheduled job to post a Miku fact with an image.
@@ -32,52 +150,12 @@ def post_miku_fact(context):
             logger.warning("Could not find a unique fact after multiple attempts. Skipping post.")
             return
         
-        # Get a random image
-        image_data = get_random_miku_image()
-        if not image_data:
-            logger.error("Failed to get a Miku image for fact post")
-            return
-            
-        image_url = image_data["image_url"]
+        content = _send_new_image(context, fact, "fact")
         
-        # Create the content package for checking
-        content = {
-            "image_url": image_url,
-            "caption": fact,
-            "source": image_data.get("source", "")
-        }
-        
-        # Check if this content is already in history (using enhanced deduplication)
-        content_attempts = 0
-        while is_in_history("urls", image_url, content) and content_attempts < max_attempts:
-            # Try to get a new image
-            image_data = get_random_miku_image()
-            if not image_data:
-                logger.error("Failed to get a unique Miku image after multiple attempts")
-                break
-                
-            image_url = image_data["image_url"]
-            content = {
-                "image_url": image_url,
-                "caption": fact,
-                "source": image_data.get("source", "")
-            }
-            content_attempts += 1
-            
-        # If we still have a duplicate after many attempts, log and skip
-        if content_attempts >= max_attempts and is_in_history("urls", image_url, content):
-            logger.warning("Could not create unique content after multiple attempts. Skipping post.")
-            return
-        
-        # Log that we're sending non-duplicate content
-        logger.info(f"Sending fact post with unique content (attempts: facts={fact_attempts}, images={content_attempts})")
-        
-        # Send the post
-        send_post(context, content)
-        
-        # Record used content in history with enhanced tracking
-        add_to_history("facts", fact)
-        add_to_history("urls", image_url, content)
+        # Record used content in history with enhanced tracking, only once
+        # it's actually been sent
+        if content:
+            record_post(content, fact=fact)
         
     except Exception as e:
         logger.error(f"Error in post_miku_fact: {e}")
@@ -90,54 +168,11 @@ def post_miku_image(context):
         # Get a random caption
         caption = get_random_miku_caption()
         
-        # Get a random image
-        image_data = get_random_miku_image()
-        if not image_data:
-            logger.error("Failed to get a Miku image for image post")
-            return
-            
-        image_url = image_data["image_url"]
-        
-        # Create the content package
-        content = {
-            "image_url": image_url,
-            "caption": caption,
-            "source": image_data.get("source", "")
-        }
-        
-        # Check if this content is already in history using enhanced checks
-        max_attempts = 15
-        content_attempts = 0
-        
-        while is_in_history("urls", image_url, content) and content_attempts < max_attempts:
-            # Try to get a new image
-            image_data = get_random_miku_image()
-            if not image_data:
-                logger.error("Failed to get a unique Miku image after multiple attempts")
-                break
-                
-            image_url = image_data["image_url"]
-            # Update the content with the new image
-            content = {
-                "image_url": image_url,
-                "caption": caption,
-                "source": image_data.get("source", "")
-            }
-            content_attempts += 1
-            
-        # If we still have a duplicate after many attempts, log and skip
-        if content_attempts >= max_attempts and is_in_history("urls", image_url, content):
-            logger.warning("Could not create unique image content after multiple attempts. Skipping post.")
-            return
-            
-        # Log that we're sending non-duplicate content
-        logger.info(f"Sending image post with unique content (attempts: {content_attempts})")
-        
-        # Send the post
-        send_post(context, content)
+        content = _send_new_image(context, caption, "image")
         
         # Record used content in history with enhanced tracking
-        add_to_history("urls", image_url, content)
+        if content:
+            record_post(content)
         
     except Exception as e:
         logger.error(f"Error in post_miku_image: {e}")
@@ -163,15 +198,12 @@ def post_reddit_miku(context):
                 logger.info(f"Skipping already posted Reddit content: {post.get('id', 'unknown')} (URL: {post['image_url'][:30]}...)")
                 continue
                 
-            # Send the post
-            send_post(context, post)
+            # Send the post, skipping it if it wasn't sent
+            if send_post(context, post) != SENT:
+                continue
             
             # Record used content in history with enhanced tracking
-            add_to_history("urls", post["image_url"], post)
-            
-            # If the post has an ID, add it specifically
-            if "id" in post:
-                add_to_history("post_ids", post["id"])
+            record_post(post)
             
             posted_count += 1
             
@@ -186,12 +218,54 @@ def post_reddit_miku(context):
     except Exception as e:
         logger.error(f"Error in post_reddit_miku: {e}")
 
+def _post_new_reddit_post(context, post, mode):
+    """
+    Send a newly detected Reddit post unless it's already in the history.
+    
+    Args:
+        context: Telegram context
+        post (Post): The post, as made by reddit_tracker
+        mode (str): "poll" or "stream", for the latency metric
+        
+    Returns:
+        bool: True if the post was sent
+    """
+    # Double-check post isn't already in history
+    if is_in_history("urls", post["image_url"], post):
+        logger.info(f"Skipping already posted Reddit content: {post.get('id', 'unknown')}")
+        return False
+        
+    # Send the post
+    if send_post(context, post) != SENT:
+        return False
+    
+    # Record used content in history with enhanced tracking
+    record_post(post)
+    
+    if post.created_utc:
+        metrics.observe(f"reddit.{mode}.post_lag_seconds", time.time() - post.created_utc)
+    return True
+
+def post_streamed_reddit_post(context):
+    """
+    Job queued by the submission stream worker for each new Reddit post.
+    """
+    try:
+        _post_new_reddit_post(context, context.job.context, "stream")
+    except Exception as e:
+        logger.error(f"Error in post_streamed_reddit_post: {e}")
+
 def check_new_reddit_posts(context):
     """
     Frequently checks for new Reddit posts and posts them immediately.
     This allows us to post new content as soon as it appears.
+    In stream mode this is the fallback, and only runs while the stream
+    worker isn't getting responses.
     """
     try:
+        if REDDIT_INGESTION_MODE == "stream" and stream_is_healthy():
+            return
+            
         # Check for new posts
         new_posts = check_for_new_posts()
         
@@ -202,21 +276,9 @@ def check_new_reddit_posts(context):
         
         posted_count = 0
         for post in new_posts:
-            # Double-check post isn't already in history
-            if is_in_history("urls", post["image_url"], post):
-                logger.info(f"Skipping already posted Reddit content: {post.get('id', 'unknown')}")
+            if not _post_new_reddit_post(context, post, "poll"):
                 continue
                 
-            # Send the post
-            send_post(context, post)
-            
-            # Record used content in history with enhanced tracking
-            add_to_history("urls", post["image_url"], post)
-            
-            # If the post has an ID, add it specifically
-            if "id" in post:
-                add_to_history("post_ids", post["id"])
-                
             posted_count += 1
             
             # Small delay between posts to avoid flooding
@@ -228,6 +290,19 @@ def check_new_reddit_posts(context):
     except Exception as e:
         logger.error(f"Error in check_new_reddit_posts: {e}")
 
+def initialize_reddit_tracking(context):
+    """
+    Record the newest post of each subreddit, so check_new_reddit_posts
+    only reports posts made after startup.
+    
+    Args:
+        context: Telegram context
+    """
+    try:
+        ensure_tracking_initialized()
+    except Exception as e:
+        logger.error(f"Error in initialize_reddit_tracking: {e}")
+
 def setup_scheduler(updater: Updater):
     """
     Set up the scheduler for regular posts.
@@ -237,8 +312,9 @@ def setup_scheduler(updater: Updater):
     """
     job_queue = updater.job_queue
     
-    # Initialize Reddit tracking
-    initialize_last_post_ids()
+    # Initialize Reddit tracking in a job, so the Reddit requests it makes
+    # don't hold up startup
+    job_queue.run_once(initialize_reddit_tracking, when=0)
     
     # Schedule the main posts every 30 minutes
     job_queue.run_repeating(
@@ -268,4 +344,9 @@ def setup_scheduler(updater: Updater):
         first=30  # Start after 30 seconds
     )
     
+    # In stream mode, new posts are pushed to the job queue as they're seen
+    # and the polling job above only runs if the stream stalls
+    if REDDIT_INGESTION_MODE == "stream":
+        start_stream(lambda post: job_queue.run_once(post_streamed_reddit_post, 0, context=post))
+    
     logger.info("Scheduler set up successfully")
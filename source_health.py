@@ -0,0 +1,227 @@
+"""
+Rolling health statistics and circuit breakers for the image sources.
+They decide which sources get_random_miku_image asks first, and which ones
+it leaves alone while they're failing.
+"""
+import random
+import threading
+import time
+from collections import deque
+from config import (
+    SOURCE_STATS_WINDOW, SOURCE_FAILURE_THRESHOLD,
+    SOURCE_COOLDOWN, SOURCE_MAX_COOLDOWN
+)
+
+# Outcomes of a fetch
+OK = "ok"
+DUPLICATE = "duplicate"
+ERROR = "error"
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float("inf"))
+
+# Circuit breaker states
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class SourceHealth:
+    """
+    Outcomes of a source's recent fetches plus its circuit breaker.
+
+    The breaker opens after `failure_threshold` errors in a row and rejects
+    requests for a cooldown. Then one probe request is let through: success
+    closes the breaker, failure reopens it with the cooldown doubled (up to
+    `max_cooldown`).
+    """
+
+    def __init__(self, name, window=SOURCE_STATS_WINDOW, failure_threshold=SOURCE_FAILURE_THRESHOLD,
+                 cooldown=SOURCE_COOLDOWN, max_cooldown=SOURCE_MAX_COOLDOWN):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._outcomes = deque(maxlen=window)  # (outcome, latency)
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._consecutive_errors = 0
+        self._cooldown = cooldown
+        self._opened_at = 0
+        self._probe_started_at = None
+
+    @property
+    def state(self):
+        return self._state
+
+    def may_try(self):
+        """
+        Check whether a request would currently be let through, without
+        taking the half-open probe. Used for ordering sources, where most of
+        those ordered are never called.
+
+        Returns:
+            bool: False while the breaker would reject a request to this source
+        """
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            now = time.monotonic()
+            if self._state == OPEN:
+                return now - self._opened_at >= self._cooldown
+            return self._probe_started_at is None or now - self._probe_started_at >= self._cooldown
+
+    def allow_request(self):
+        """
+        Let a request through if the breaker allows it. In the half-open
+        state this takes the single probe, so call it only right before the
+        request is made.
+
+        Returns:
+            bool: False while the breaker rejects requests to this source
+        """
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            now = time.monotonic()
+            if self._state == OPEN:
+                if now - self._opened_at < self._cooldown:
+                    return False
+                self._state = HALF_OPEN
+            elif self._probe_started_at is not None and now - self._probe_started_at < self._cooldown:
+                # A probe is already out; only replace it if it never reported back
+                return False
+            self._probe_started_at = now
+            return True
+
+    def record(self, outcome, latency):
+        """
+        Args:
+            outcome (str): OK, DUPLICATE or ERROR
+            latency (float): Seconds the fetch took
+        """
+        with self._lock:
+            self._outcomes.append((outcome, latency))
+            if outcome == ERROR:
+                self._consecutive_errors += 1
+                if self._state == HALF_OPEN:
+                    self._cooldown = min(self._cooldown * 2, self.max_cooldown)
+                    self._open()
+                elif self._state == CLOSED and self._consecutive_errors >= self.failure_threshold:
+                    self._open()
+            else:
+                self._consecutive_errors = 0
+                self._state = CLOSED
+                self._cooldown = self.base_cooldown
+                self._probe_started_at = None
+
+    def _open(self):
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self._probe_started_at = None
+
+    def expected_time_to_unique(self):
+        """
+        Estimate how long this source takes to produce an image that hasn't
+        been posted: mean latency divided by the chance of a new image.
+        Both use add-one smoothing so a source with few samples isn't
+        written off or overrated.
+
+        Returns:
+            float: Expected seconds per new image
+        """
+        with self._lock:
+            outcomes = list(self._outcomes)
+        new_images = sum(1 for outcome, _ in outcomes if outcome == OK)
+        mean_latency = (sum(latency for _, latency in outcomes) + 1) / (len(outcomes) + 1)
+        return mean_latency * (len(outcomes) + 2) / (new_images + 1)
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: Rolling rates, latency histogram and breaker state
+        """
+        with self._lock:
+            outcomes = list(self._outcomes)
+            state = self._state
+            cooldown_left = max(0, self._cooldown - (time.monotonic() - self._opened_at)) if state == OPEN else 0
+
+        total = len(outcomes)
+        counts = {OK: 0, DUPLICATE: 0, ERROR: 0}
+        histogram = dict.fromkeys((str(bound) for bound in LATENCY_BUCKETS), 0)
+        for outcome, latency in outcomes:
+            counts[outcome] += 1
+            for bound in LATENCY_BUCKETS:
+                if latency <= bound:
+                    histogram[str(bound)] += 1
+                    break
+
+        return {
+            "samples": total,
+            "success_rate": (counts[OK] + counts[DUPLICATE]) / total if total else None,
+            "duplicate_rate": counts[DUPLICATE] / total if total else None,
+            "error_rate": counts[ERROR] / total if total else None,
+            "latency_histogram": histogram,
+            "expected_seconds_per_new_image": self.expected_time_to_unique(),
+            "breaker": state,
+            "cooldown_remaining": round(cooldown_left, 1)
+        }
+
+_sources = {}
+_sources_lock = threading.Lock()
+
+def get_source_health(name):
+    """
+    Args:
+        name (str): Source name
+
+    Returns:
+        SourceHealth: The source's stats, created on first use
+    """
+    health = _sources.get(name)
+    if health is None:
+        with _sources_lock:
+            health = _sources.setdefault(name, SourceHealth(name))
+    return health
+
+def order_sources(names):
+    """
+    Order sources for trying, skipping those whose breaker is open.
+
+    Sources are drawn at random without replacement, each with probability
+    proportional to 1 / expected time to a new image, so faster and more
+    productive sources tend to go first while the others still get traffic
+    and keep their stats current.
+
+    Args:
+        names (list): Source names
+
+    Only checks the breakers (see SourceHealth.may_try); the caller takes a
+    half-open source's probe with allow_request when it actually calls it.
+
+    Returns:
+        list: The names of sources that may be called, in the order to try them
+    """
+    weighted = [
+        (name, 1 / get_source_health(name).expected_time_to_unique())
+        for name in names
+        if get_source_health(name).may_try()
+    ]
+    ordered = []
+    while weighted:
+        pick = random.uniform(0, sum(weight for _, weight in weighted))
+        for index, (name, weight) in enumerate(weighted):
+            pick -= weight
+            if pick <= 0 or index == len(weighted) - 1:
+                ordered.append(name)
+                del weighted[index]
+                break
+    return ordered
+
+def snapshot():
+    """
+    Returns:
+        dict: Each source's health snapshot, by name
+    """
+    with _sources_lock:
+        sources = dict(_sources)
+    return {name: health.snapshot() for name, health in sources.items()}
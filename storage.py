@@ -1,64 +1,473 @@
-import json
 import os
 import logging
 import hashlib
 import re
+import threading
+import queue
+import atexit
+import time
+import heapq
+import struct
 import urllib.parse
-from config import HISTORY_FILE
+from concurrent.futures import Future
+from history_backends import create_history_backend, merge_records
+from history_index import PackedKeyTable, BloomFilter, item_key
+from image_fingerprints import HammingIndex
+from config import (
+    IMAGE_HASH_THRESHOLD, REPOST_WINDOW_DAYS,
+    HISTORY_BLOOM_FILE, BLOOM_FALSE_POSITIVE_RATE, HISTORY_EXPIRY_INTERVAL
+)
+import metrics
 
 logger = logging.getLogger(__name__)
 
-def load_post_history():
+# Categories every history file is expected to contain
+HISTORY_CATEGORIES = (
+    "urls",
+    "normalized_urls",
+    "facts",
+    "content_hashes",
+    "image_fingerprints",
+    "post_ids"
+)
+
+# Categories checked through a Bloom filter before the exact index
+BLOOM_CATEGORIES = ("urls", "normalized_urls")
+
+# Bloom filters are sized for at least this many items, and twice the
+# number currently stored, so they don't need rebuilding after every post
+BLOOM_MIN_CAPACITY = 10000
+
+# Per-category header in the Bloom filter file: name length, key checksum, filter size
+BLOOM_ENTRY = struct.Struct('<HQQ')
+
+# Repost windows in seconds; categories without one are remembered forever
+REPOST_WINDOWS = {
+    category: days * 86400
+    for category, days in REPOST_WINDOW_DAYS.items()
+    if days is not None
+}
+
+class PostHistory:
     """
-    Load the post history from a JSON file.
+    In-memory, indexed view of the post history.
     
-    Returns:
-        dict: The post history or an empty dict if the file doesn't exist
+    The history is read from its backend once. Each category is then kept as
+    a PackedKeyTable mapping the 64-bit key of every item to the time it was
+    posted, giving O(1) lookups without holding the item strings in memory.
+    Each change is handed to the backend as soon as it is made.
+    
+    Items in categories with a repost window are forgotten once the window has
+    passed. A heap ordered by expiry time means expiring old items never has
+    to scan the whole history. Image fingerprints are also kept in a Hamming
+    index for near-duplicate search.
+    
+    URL lookups first go through a Bloom filter, so the common case of a URL
+    that was never posted is answered without touching the exact index. The
+    filters are saved next to the history and rebuilt whenever the journal
+    is compacted.
+    
+    All changes and backend access go through a queue to a single writer
+    thread, so concurrent jobs can't lose each other's updates. Lookups read
+    the index directly without taking any lock.
     """
-    if not os.path.exists(HISTORY_FILE):
-        return {
-            "urls": [], 
-            "facts": [], 
-            "content_hashes": [], 
-            "image_fingerprints": [],
-            "post_ids": []
-        }
     
-    try:
-        with open(HISTORY_FILE, 'r') as file:
-            history = json.load(file)
+    def __init__(self, backend=None, repost_windows=REPOST_WINDOWS, bloom_path=HISTORY_BLOOM_FILE):
+        if backend is None:
+            backend = create_history_backend(HISTORY_CATEGORIES)
+        self._backend = backend
+        self.repost_windows = repost_windows
+        self.bloom_path = bloom_path
+        self._load()
+        self._load_blooms()
+        
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(target=self._run_writer, name="history-writer")
+        self._writer.daemon = True
+        self._writer.start()
+    
+    def _load(self):
+        """Replay the backend into memory"""
+        self._reset()
+        try:
+            self._apply(merge_records(self._backend.load(), self.repost_windows))
+        except Exception as e:
+            logger.error(f"Error loading post history: {e}")
+    
+    def _reset(self):
+        self._index = {}
+        self._blooms = {}
+        self._expiry_heap = []
+        self._image_index = HammingIndex(IMAGE_HASH_THRESHOLD)
+        for category in HISTORY_CATEGORIES:
+            self._ensure_category(category)
+    
+    def _apply(self, history):
+        for category, items in history.items():
+            for item, posted_at in items.items():
+                self._insert(category, item, posted_at)
+    
+    def _ensure_category(self, category):
+        if category not in self._index:
+            self._index[category] = PackedKeyTable()
+        return self._index[category]
+    
+    def _insert(self, category, item, posted_at):
+        index = self._ensure_category(category)
+        key = item_key(item)
+        if index.get(key) is not None:
+            return False
+        
+        index.set(key, posted_at)
+        if category == "image_fingerprints":
+            self._image_index.add(item)
+        
+        bloom = self._blooms.get(category)
+        if bloom is not None:
+            bloom.add(key)
+            if bloom.count > bloom.capacity:
+                self._rebuild_bloom(category)
+            else:
+                metrics.set_gauge(f"history.bloom.{category}.expected_fp_rate", bloom.expected_false_positive_rate)
+        
+        window = self.repost_windows.get(category)
+        if window is not None:
+            # Fingerprints are needed back to drop them from the Hamming index
+            fingerprint = item if category == "image_fingerprints" else None
+            heapq.heappush(self._expiry_heap, (posted_at + window, category, key, fingerprint))
+        return True
+    
+    def _expire(self):
+        """Forget items whose repost window has passed"""
+        now = time.time()
+        expired = {}
+        heap = self._expiry_heap
+        while heap and heap[0][0] <= now:
+            expires_at, category, key, fingerprint = heapq.heappop(heap)
+            index = self._index[category]
+            posted_at = index.get(key)
+            # Skip heap entries left behind when an item was posted again
+            if posted_at is None or posted_at + self.repost_windows[category] != expires_at:
+                continue
+            index.remove(key)
+            if fingerprint is not None:
+                self._image_index.remove(fingerprint)
+            expired[category] = max(expired.get(category, 0), posted_at)
+        
+        for category, newest in expired.items():
+            try:
+                self._backend.expire(category, newest)
+            except Exception as e:
+                logger.error(f"Error expiring post history: {e}")
+    
+    def _rebuild_bloom(self, category):
+        keys = self._index[category].keys()
+        bloom = BloomFilter(max(BLOOM_MIN_CAPACITY, 2 * len(keys)), BLOOM_FALSE_POSITIVE_RATE)
+        for key in keys:
+            bloom.add(key)
+        self._blooms[category] = bloom
+        metrics.set_gauge(f"history.bloom.{category}.expected_fp_rate", bloom.expected_false_positive_rate)
+    
+    def _rebuild_blooms(self):
+        for category in BLOOM_CATEGORIES:
+            self._rebuild_bloom(category)
+    
+    @staticmethod
+    def _key_checksum(keys):
+        checksum = 0
+        for key in keys:
+            checksum ^= key
+        return checksum
+    
+    def _load_blooms(self):
+        """
+        Use the saved Bloom filters if they still describe the loaded history,
+        otherwise rebuild them from the index.
+        """
+        metrics.set_gauge("history.bloom.target_fp_rate", BLOOM_FALSE_POSITIVE_RATE)
+        saved = {}
+        if os.path.exists(self.bloom_path):
+            try:
+                with open(self.bloom_path, 'rb') as file:
+                    data = file.read()
+                offset = 0
+                while offset < len(data):
+                    name_length, checksum, size = BLOOM_ENTRY.unpack_from(data, offset)
+                    offset += BLOOM_ENTRY.size
+                    category = data[offset:offset + name_length].decode()
+                    offset += name_length
+                    saved[category] = (checksum, BloomFilter.from_bytes(data[offset:offset + size]))
+                    offset += size
+            except Exception as e:
+                logger.warning(f"Ignoring unreadable Bloom filter file: {e}")
+                saved = {}
+        
+        for category in BLOOM_CATEGORIES:
+            keys = self._index[category].keys()
+            checksum, bloom = saved.get(category, (None, None))
+            if bloom is not None and bloom.count == len(keys) and checksum == self._key_checksum(keys):
+                self._blooms[category] = bloom
+                metrics.set_gauge(f"history.bloom.{category}.expected_fp_rate", bloom.expected_false_positive_rate)
+            else:
+                self._rebuild_bloom(category)
+    
+    def _save_blooms(self):
+        data = bytearray()
+        for category, bloom in self._blooms.items():
+            name = category.encode()
+            payload = bloom.to_bytes()
+            checksum = self._key_checksum(self._index[category].keys())
+            data += BLOOM_ENTRY.pack(len(name), checksum, len(payload)) + name + payload
+        
+        try:
+            temp_path = self.bloom_path + ".tmp"
+            with open(temp_path, 'wb') as file:
+                file.write(data)
+            os.replace(temp_path, self.bloom_path)
+        except Exception as e:
+            logger.error(f"Error saving Bloom filters: {e}")
+    
+    def contains(self, category, item):
+        """
+        Check whether an item is stored in the given category and its
+        repost window, if any, hasn't passed yet.
+        
+        Args:
+            category (str): The history category ('urls', 'facts', etc.)
+            item (str): The item to look up
+            
+        Returns:
+            bool: True if the item is in the history
+        """
+        index = self._index.get(category)
+        if index is None:
+            return False
+        key = item_key(item)
+        
+        bloom = self._blooms.get(category)
+        if bloom is not None:
+            metrics.increment("history.bloom.checks")
+            if not bloom.might_contain(key):
+                metrics.increment("history.bloom.definite_misses")
+                return False
+        
+        posted_at = index.get(key)
+        if posted_at is None:
+            if bloom is not None:
+                metrics.increment("history.bloom.false_positives")
+            return False
+        window = self.repost_windows.get(category)
+        return window is None or time.time() < posted_at + window
+    
+    def find_similar_image(self, fingerprint):
+        """
+        Args:
+            fingerprint (str): Hex image fingerprint
+            
+        Returns:
+            str: A stored fingerprint within IMAGE_HASH_THRESHOLD bits, or None
+        """
+        match = self._image_index.find(fingerprint)
+        if match and self.contains("image_fingerprints", match):
+            return match
+        return None
+    
+    def add(self, category, item):
+        """
+        Add an item to a category if it isn't already there.
+        
+        Args:
+            category (str): The history category ('urls', 'facts', etc.)
+            item (str): The item to add
             
-            # Make sure all needed categories exist
-            if "content_hashes" not in history:
-                history["content_hashes"] = []
-            if "image_fingerprints" not in history:
-                history["image_fingerprints"] = []
-            if "post_ids" not in history:
-                history["post_ids"] = []
+        Returns:
+            bool: True if the item was added, False if it was already present
+        """
+        return bool(self.add_record({category: [item]}))
+    
+    def add_record(self, record, posted_at=None):
+        """
+        Add several items at once and persist them in a single write.
+        Returns once the items are visible to lookups and saved.
+        
+        Args:
+            record (dict): Mapping of history category to items to add
+            posted_at (float, optional): When the items were posted, as a Unix
+                timestamp. Defaults to now.
+            
+        Returns:
+            dict: The items that were actually new, by category
+        """
+        if posted_at is None:
+            posted_at = time.time()
+        return self._submit("add", record, posted_at)
+    
+    def to_dict(self):
+        """
+        Read the full history back from the backend, since only item keys
+        are kept in memory.
+        
+        Returns:
+            dict: A copy of the history as plain lists, oldest items first
+        """
+        history = self._submit("load")
+        for category in HISTORY_CATEGORIES:
+            history.setdefault(category, {})
+        return {category: list(items) for category, items in history.items()}
+    
+    def replace(self, history):
+        """
+        Replace the whole history and write it to the backend.
+        Lookups made while the new history is being indexed may miss items.
+        
+        Args:
+            history (dict): The new post history, as lists of items or
+                dicts mapping items to the time they were posted
+        """
+        self._submit("replace", merge_records([history], self.repost_windows))
+    
+    def close(self):
+        """Save the Bloom filters, release the backend and stop the writer"""
+        if self._writer.is_alive():
+            self._submit("close")
+            self._writer.join()
+    
+    def _submit(self, operation, *args):
+        if not self._writer.is_alive():
+            raise RuntimeError("Post history is closed")
+        future = Future()
+        self._queue.put((operation, args, future))
+        return future.result()
+    
+    def _run_writer(self):
+        """
+        Apply queued changes one batch at a time. Additions that arrive
+        together are saved with a single backend write.
+        """
+        while True:
+            try:
+                tasks = [self._queue.get(timeout=HISTORY_EXPIRY_INTERVAL)]
+            except queue.Empty:
+                self._expire()
+                continue
+            while True:
+                try:
+                    tasks.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            
+            self._expire()
+            pending = []
+            for position, (operation, args, future) in enumerate(tasks):
+                if operation == "add":
+                    try:
+                        pending.append((future, self._add_items(*args)))
+                    except Exception as e:
+                        future.set_exception(e)
+                    continue
                 
-            return history
-    except Exception as e:
-        logger.error(f"Error loading post history: {e}")
-        return {
-            "urls": [], 
-            "facts": [], 
-            "content_hashes": [], 
-            "image_fingerprints": [],
-            "post_ids": []
-        }
+                self._commit(pending)
+                pending = []
+                try:
+                    future.set_result(self._run_operation(operation, *args))
+                except Exception as e:
+                    future.set_exception(e)
+                
+                if operation == "close":
+                    for _, _, late_future in tasks[position + 1:]:
+                        late_future.set_exception(RuntimeError("Post history is closed"))
+                    return
+            self._commit(pending)
+    
+    def _add_items(self, record, posted_at):
+        added = {}
+        for category, items in record.items():
+            for item in items:
+                if self._insert(category, item, posted_at):
+                    added.setdefault(category, {})[item] = posted_at
+        return added
+    
+    def _commit(self, pending):
+        """Persist a batch of additions, then report them to their callers"""
+        batch = {}
+        for _, added in pending:
+            for category, items in added.items():
+                batch.setdefault(category, {}).update(items)
+        if batch:
+            self._persist(batch)
+        
+        for future, added in pending:
+            future.set_result({category: list(items) for category, items in added.items()})
+    
+    def _run_operation(self, operation, *args):
+        if operation == "load":
+            return merge_records(self._backend.load(), self.repost_windows)
+        
+        if operation == "replace":
+            history, = args
+            self._reset()
+            self._apply(history)
+            self._rebuild_blooms()
+            try:
+                self._backend.rewrite(history)
+            except Exception as e:
+                logger.error(f"Error saving post history: {e}")
+            return None
+        
+        if operation == "close":
+            self._save_blooms()
+            self._backend.close()
+            return None
+        
+        raise ValueError(f"Unknown post history operation: {operation}")
+    
+    def _persist(self, record):
+        try:
+            self._backend.append(record)
+            if self._backend.needs_compaction():
+                self._backend.compact(self.repost_windows)
+                self._rebuild_blooms()
+                self._save_blooms()
+        except Exception as e:
+            logger.error(f"Error saving post history: {e}")
+
+# Shared history instance, created on first use
+_post_history = None
+_post_history_lock = threading.Lock()
+
+def get_post_history():
+    """
+    Return the shared PostHistory instance, loading it on first use.
+    
+    Returns:
+        PostHistory: The process-wide post history
+    """
+    global _post_history
+    
+    if _post_history is None:
+        with _post_history_lock:
+            if _post_history is None:
+                _post_history = PostHistory()
+                atexit.register(_post_history.close)
+    return _post_history
+
+def load_post_history():
+    """
+    Load the post history.
+    
+    Returns:
+        dict: A copy of the post history, with every category present
+    """
+    return get_post_history().to_dict()
 
 def save_post_history(history):
     """
-    Save the post history to a JSON file.
+    Replace the saved post history.
     
     Args:
         history (dict): The post history to save
     """
-    try:
-        with open(HISTORY_FILE, 'w') as file:
-            json.dump(history, file)
-    except Exception as e:
-        logger.error(f"Error saving post history: {e}")
+    get_post_history().replace(history)
 
 def normalize_url(url):
     """
@@ -100,47 +509,185 @@ def normalize_url(url):
         logger.warning(f"Error normalizing URL {url}: {e}")
         return url
 
+# Anything that isn't a word character is ignored when comparing captions
+CAPTION_NOISE = re.compile(r'[^\w]')
+
+def clean_caption(caption):
+    """
+    Reduce a caption to lowercase word characters for fuzzy matching.
+    
+    Args:
+        caption (str): The caption to clean
+        
+    Returns:
+        str: The caption without punctuation or whitespace
+    """
+    return CAPTION_NOISE.sub('', caption.lower())
+
+def _hash_content(normalized_url, cleaned_caption, source):
+    # Create a standardized string representation of the content
+    hash_components = []
+    if normalized_url is not None:
+        hash_components.append(f"url:{normalized_url}")
+    if cleaned_caption is not None:
+        hash_components.append(f"caption:{cleaned_caption}")
+    if source:
+        hash_components.append(f"source:{source}")
+    
+    if hash_components:
+        content_str = "|".join(hash_components)
+        return hashlib.md5(content_str.encode()).hexdigest()
+    return None
+
 def create_content_hash(content_dict):
     """
     Create a hash of content to identify duplicates even if URLs are different.
     
     Args:
-        content_dict (dict): Dict containing post content like image_url, caption, etc.
+        content_dict (dict or Post): Post content like image_url, caption, etc.
         
     Returns:
         str: A hash string uniquely identifying the content
     """
     if not content_dict:
         return None
+    
+    if isinstance(content_dict, Post):
+        return content_dict.content_hash
         
     try:
-        # Create a standardized string representation of the content
-        hash_components = []
-        
-        # Add the normalized URL
+        normalized_url = None
         if 'image_url' in content_dict:
-            hash_components.append(f"url:{normalize_url(content_dict['image_url'])}")
-            
-        # Add the caption without spaces and punctuation (for fuzzy matching)
+            normalized_url = normalize_url(content_dict['image_url'])
+        
+        cleaned_caption = None
         if 'caption' in content_dict and content_dict['caption']:
-            # Remove punctuation and whitespace, convert to lowercase
-            cleaned_caption = re.sub(r'[^\w]', '', content_dict['caption'].lower())
-            hash_components.append(f"caption:{cleaned_caption}")
-            
-        # Add source if available
-        if 'source' in content_dict and content_dict['source']:
-            hash_components.append(f"source:{content_dict['source']}")
-            
-        # Generate the hash
-        if hash_components:
-            content_str = "|".join(hash_components)
-            return hashlib.md5(content_str.encode()).hexdigest()
+            cleaned_caption = clean_caption(content_dict['caption'])
+        
+        return _hash_content(normalized_url, cleaned_caption, content_dict.get('source'))
             
     except Exception as e:
         logger.error(f"Error creating content hash: {e}")
         
     return None
 
+# Marks a cached Post value that hasn't been computed yet
+_NOT_COMPUTED = object()
+
+class Post:
+    """
+    A piece of content to post, with its dedupe keys computed at most once.
+    
+    Posts support the dict-style access the rest of the bot uses for content
+    (post['image_url'], post.get('source'), 'id' in post), with unset fields
+    treated as missing keys. The normalized URL, cleaned caption and content
+    hash are computed on first use and cached until a field they depend on
+    changes.
+    """
+    
+    FIELDS = ("image_url", "caption", "source", "id", "permalink", "image_fingerprint", "created_utc")
+    
+    __slots__ = FIELDS + ("_normalized_url", "_cleaned_caption", "_content_hash")
+    
+    def __init__(self, image_url=None, caption=None, source=None, id=None,
+                 permalink=None, image_fingerprint=None, created_utc=None):
+        self.image_url = image_url
+        self.caption = caption
+        self.source = source
+        self.id = id
+        self.permalink = permalink
+        self.image_fingerprint = image_fingerprint
+        self.created_utc = created_utc
+    
+    @classmethod
+    def from_dict(cls, content):
+        """
+        Args:
+            content (dict or Post): Content dict; unknown keys are ignored
+            
+        Returns:
+            Post: The content as a Post (the same object if it already is one)
+        """
+        if isinstance(content, cls):
+            return content
+        return cls(**{field: content.get(field) for field in cls.FIELDS})
+    
+    def to_dict(self):
+        """
+        Returns:
+            dict: The fields that are set
+        """
+        return {field: getattr(self, field) for field in self.keys()}
+    
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name == "image_url":
+            object.__setattr__(self, "_normalized_url", _NOT_COMPUTED)
+            object.__setattr__(self, "_content_hash", _NOT_COMPUTED)
+        elif name == "caption":
+            object.__setattr__(self, "_cleaned_caption", _NOT_COMPUTED)
+            object.__setattr__(self, "_content_hash", _NOT_COMPUTED)
+        elif name == "source":
+            object.__setattr__(self, "_content_hash", _NOT_COMPUTED)
+    
+    @property
+    def normalized_url(self):
+        """str: The image URL passed through normalize_url"""
+        if self._normalized_url is _NOT_COMPUTED:
+            object.__setattr__(self, "_normalized_url", normalize_url(self.image_url))
+        return self._normalized_url
+    
+    @property
+    def cleaned_caption(self):
+        """str: The caption passed through clean_caption, or None without a caption"""
+        if self._cleaned_caption is _NOT_COMPUTED:
+            cleaned = clean_caption(self.caption) if self.caption else None
+            object.__setattr__(self, "_cleaned_caption", cleaned)
+        return self._cleaned_caption
+    
+    @property
+    def content_hash(self):
+        """str: Same value create_content_hash gives for the equivalent dict"""
+        if self._content_hash is _NOT_COMPUTED:
+            try:
+                normalized_url = self.normalized_url if self.image_url is not None else None
+                content_hash = _hash_content(normalized_url, self.cleaned_caption, self.source)
+            except Exception as e:
+                logger.error(f"Error creating content hash: {e}")
+                content_hash = None
+            object.__setattr__(self, "_content_hash", content_hash)
+        return self._content_hash
+    
+    def keys(self):
+        return [field for field in self.FIELDS if getattr(self, field) is not None]
+    
+    def __iter__(self):
+        return iter(self.keys())
+    
+    def __contains__(self, key):
+        return key in self.FIELDS and getattr(self, key) is not None
+    
+    def __getitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        return getattr(self, key)
+    
+    def __setitem__(self, key, value):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        setattr(self, key, value)
+    
+    def get(self, key, default=None):
+        if key not in self:
+            return default
+        return getattr(self, key)
+    
+    def __bool__(self):
+        return True
+    
+    def __repr__(self):
+        return f"Post({self.to_dict()!r})"
+
 def add_to_history(item_type, item_content, content_dict=None):
     """
     Add an item to the post history.
@@ -150,43 +697,76 @@ def add_to_history(item_type, item_content, content_dict=None):
         item_content (str): The content to add
         content_dict (dict, optional): Full content dictionary for hash generation
     """
-    history = load_post_history()
-    
-    # Ensure the type exists in history
-    if item_type not in history:
-        history[item_type] = []
-    
-    # Add the item if it's not already there
-    if item_content not in history[item_type]:
-        history[item_type].append(item_content)
-        
-        # Limit the history size to prevent unlimited growth
-        max_history = 1000  # Increased from 500 to store more history
-        if len(history[item_type]) > max_history:
-            history[item_type] = history[item_type][-max_history:]
-        
-        # If this is a URL, normalize it and add that too
-        if item_type == "urls":
-            normalized_url = normalize_url(item_content)
-            if normalized_url and normalized_url != item_content:
-                if "normalized_urls" not in history:
-                    history["normalized_urls"] = []
-                if normalized_url not in history["normalized_urls"]:
-                    history["normalized_urls"].append(normalized_url)
-        
-        # If we have the full content dict, create and store a content hash
-        if content_dict:
-            content_hash = create_content_hash(content_dict)
-            if content_hash and "content_hashes" in history and content_hash not in history["content_hashes"]:
-                history["content_hashes"].append(content_hash)
-                
-            # If it's a Reddit post, store the post ID too
-            if "id" in content_dict:
-                post_id = content_dict["id"]
-                if post_id and "post_ids" in history and post_id not in history["post_ids"]:
-                    history["post_ids"].append(post_id)
+    history = get_post_history()
+    
+    # Nothing else is recorded for an item we've already seen
+    if history.contains(item_type, item_content):
+        return
+    
+    record = {item_type: [item_content]}
+    post = Post.from_dict(content_dict) if content_dict else None
+    
+    # If this is a URL, normalize it and add that too
+    if item_type == "urls":
+        normalized_url = _normalized_url_for(item_content, post)
+        if normalized_url and normalized_url != item_content:
+            record["normalized_urls"] = [normalized_url]
+    
+    # If we have the full content dict, add its hash and Reddit post ID too
+    if post is not None:
+        _add_content_keys(record, post)
+    
+    history.add_record(record)
+
+def record_post(content, fact=None):
+    """
+    Record everything needed to recognize a sent post as a duplicate later.
+    The URL, normalized URL, content hash, post ID and fact are all saved in
+    a single write, so a post is never left half recorded.
+    
+    Args:
+        content (Post or dict): The post content with 'image_url' and optionally
+            'caption', 'source', 'id' and 'image_fingerprint'
+        fact (str, optional): The Miku fact used as the caption
         
-        save_post_history(history)
+    Returns:
+        dict: The items that were new to the history, by category
+    """
+    post = Post.from_dict(content)
+    record = {}
+    
+    if post.image_url:
+        record["urls"] = [post.image_url]
+        normalized_url = post.normalized_url
+        if normalized_url and normalized_url != post.image_url:
+            record["normalized_urls"] = [normalized_url]
+    
+    _add_content_keys(record, post)
+    
+    if fact:
+        record["facts"] = [fact]
+    
+    return get_post_history().add_record(record)
+
+def _normalized_url_for(url, post):
+    # Reuse the post's cached normalized URL when it is for the same URL
+    if post is not None and post.image_url == url:
+        return post.normalized_url
+    return normalize_url(url)
+
+def _add_content_keys(record, post):
+    content_hash = post.content_hash
+    if content_hash:
+        record.setdefault("content_hashes", []).append(content_hash)
+    
+    # If it's a Reddit post, store the post ID too
+    if post.id:
+        record.setdefault("post_ids", []).append(post.id)
+    
+    # Fingerprint of the downloaded image, if it was computed
+    fingerprint = post.image_fingerprint
+    if fingerprint:
+        record.setdefault("image_fingerprints", []).append(fingerprint)
 
 def is_in_history(item_type, item_content, content_dict=None):
     """
@@ -195,37 +775,93 @@ def is_in_history(item_type, item_content, content_dict=None):
     Args:
         item_type (str): The type of item ('urls' or 'facts')
         item_content (str): The content to check
-        content_dict (dict, optional): Full content dictionary for hash checking
+        content_dict (Post or dict, optional): Full content for hash checking
         
     Returns:
         bool: True if the item is in the history, False otherwise
     """
-    history = load_post_history()
+    history = get_post_history()
+    post = Post.from_dict(content_dict) if content_dict else None
     
     # Direct check of the item in the specific history type
-    if item_type in history and item_content in history[item_type]:
+    if history.contains(item_type, item_content):
         logger.info(f"Found direct match for {item_type} in history")
         return True
         
     # For URLs, also check the normalized version
     if item_type == "urls":
-        normalized_url = normalize_url(item_content)
-        if "normalized_urls" in history and normalized_url in history["normalized_urls"]:
+        normalized_url = _normalized_url_for(item_content, post)
+        if history.contains("normalized_urls", normalized_url):
             logger.info(f"Found normalized URL match in history")
             return True
     
     # For content dictionaries, check content hash
-    if content_dict:
-        content_hash = create_content_hash(content_dict)
-        if content_hash and "content_hashes" in history and content_hash in history["content_hashes"]:
+    if post is not None:
+        content_hash = post.content_hash
+        if content_hash and history.contains("content_hashes", content_hash):
             logger.info(f"Found content hash match in history")
             return True
             
         # Check post ID for Reddit content
-        if "id" in content_dict:
-            post_id = content_dict["id"]
-            if post_id and "post_ids" in history and post_id in history["post_ids"]:
-                logger.info(f"Found post ID match in history")
-                return True
+        if post.id and history.contains("post_ids", post.id):
+            logger.info(f"Found post ID match in history")
+            return True
+        
+        # Check for a visually similar image posted under another URL
+        fingerprint = post.image_fingerprint
+        if fingerprint and history.find_similar_image(fingerprint):
+            logger.info(f"Found similar image fingerprint in history")
+            return True
     
     return False
+
+def filter_new_posts(posts):
+    """
+    Drop posts whose image was already posted, checking a whole batch at once.
+    
+    Only the image keys are checked (URL, normalized URL and post ID), since
+    candidates from an image API have no caption yet. Repeats within the
+    batch are dropped too, and a summary is logged instead of one line per
+    match.
+    
+    Args:
+        posts (list): Post records (or content dicts)
+        
+    Returns:
+        list: The new posts as Post records, in their original order
+    """
+    history = get_post_history()
+    seen = set()
+    new_posts = []
+    for post in posts:
+        post = Post.from_dict(post)
+        if not post.image_url:
+            continue
+        normalized_url = post.normalized_url
+        if normalized_url in seen:
+            continue
+        seen.add(normalized_url)
+        
+        if (history.contains("urls", post.image_url)
+                or history.contains("normalized_urls", normalized_url)
+                or (post.id and history.contains("post_ids", post.id))):
+            continue
+        new_posts.append(post)
+        
+    if len(new_posts) < len(posts):
+        logger.debug(f"Filtered {len(posts) - len(new_posts)} of {len(posts)} posts already in history")
+    return new_posts
+
+def find_similar_image(fingerprint):
+    """
+    Check whether an image that looks like this one was already posted.
+    
+    Args:
+        fingerprint (str): Hex fingerprint from compute_image_fingerprint
+        
+    Returns:
+        str: The matching stored fingerprint, or None if there is no match
+    """
+    if not fingerprint:
+        return None
+    return get_post_history().find_similar_image(fingerprint)
@@ -0,0 +1,126 @@
+"""
+Concurrency stress test for the post history.
+Many threads record posts through record_post and check them with
+is_in_history right away, while also checking posts other threads recorded.
+The history is then reloaded from disk and every record must still be
+there. Runs against the json and sqlite backends in a temporary directory,
+so the bot's own history is never touched.
+
+Exits non-zero on any read-after-write miss or record missing after reload.
+
+Usage: python stress_history.py [--threads N] [--posts N] [--backends json sqlite]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import storage
+from history_backends import JournalBackend, SQLBackend
+from storage import PostHistory, Post, HISTORY_CATEGORIES, record_post, is_in_history
+
+# Small enough that the json run rotates and compacts the journal mid-test
+JOURNAL_COMPACT_THRESHOLD = 64 * 1024
+
+def create_backend(name, directory):
+    """
+    Args:
+        name (str): "json" or "sqlite"
+        directory (str): Where the backend keeps its files
+
+    Returns:
+        JournalBackend or SQLBackend: A backend on files in `directory`
+    """
+    if name == "json":
+        return JournalBackend(
+            snapshot_path=os.path.join(directory, "post_history.json"),
+            journal_path=os.path.join(directory, "post_history.journal"),
+            compact_threshold=JOURNAL_COMPACT_THRESHOLD
+        )
+    return SQLBackend("sqlite", os.path.join(directory, "post_history.db"), HISTORY_CATEGORIES)
+
+def open_history(name, directory):
+    history = PostHistory(create_backend(name, directory), bloom_path=os.path.join(directory, "post_history.bloom"))
+    # record_post and is_in_history go through the shared instance
+    storage._post_history = history
+    return history
+
+def make_post(thread, number):
+    return Post(
+        image_url=f"https://stress.example/{thread}/{number}.jpg",
+        caption=f"Stress post {thread}-{number}",
+        source="stress_history",
+        id=f"{thread}x{number}"
+    )
+
+def is_recorded(post):
+    return is_in_history("urls", post.image_url, post) and is_in_history("facts", post.caption)
+
+def run_writers(threads, posts):
+    """
+    Returns:
+        tuple: (recorded Posts, list of read-after-write misses)
+    """
+    recorded = []
+    misses = []
+    start = threading.Barrier(threads)
+
+    def worker(thread):
+        start.wait()
+        for number in range(posts):
+            post = make_post(thread, number)
+            record_post(post, fact=post.caption)
+            if not is_recorded(post):
+                misses.append(f"own post {post.id} right after recording")
+            recorded.append(post)
+            # Check a post some thread already recorded
+            other = random.choice(recorded)
+            if not is_recorded(other):
+                misses.append(f"post {other.id} recorded by another thread")
+
+    workers = [threading.Thread(target=worker, args=(thread,)) for thread in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return recorded, misses
+
+def stress_backend(name, threads, posts):
+    """
+    Returns:
+        bool: True if nothing was lost
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        history = open_history(name, directory)
+        started = time.perf_counter()
+        recorded, misses = run_writers(threads, posts)
+        elapsed = time.perf_counter() - started
+        history.close()
+
+        history = open_history(name, directory)
+        missing = [post.id for post in recorded if not is_recorded(post)]
+        history.close()
+        storage._post_history = None
+
+    print(f"{name:8} {len(recorded)} posts from {threads} threads in {elapsed:.2f}s: "
+          f"{len(misses)} read-after-write misses, {len(missing)} missing after reload")
+    for miss in misses[:5]:
+        print(f"  miss: {miss}")
+    if missing:
+        print(f"  missing after reload: {', '.join(missing[:5])}")
+    return len(recorded) == threads * posts and not misses and not missing
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--threads", type=int, default=32, help="concurrent writer threads")
+    parser.add_argument("--posts", type=int, default=200, help="posts recorded per thread")
+    parser.add_argument("--backends", nargs="+", default=["json", "sqlite"], choices=["json", "sqlite"])
+    args = parser.parse_args()
+
+    results = [stress_backend(name, args.threads, args.posts) for name in args.backends]
+    sys.exit(0 if all(results) else 1)
+
+if __name__ == "__main__":
+    main()
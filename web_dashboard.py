@@ -177,12 +177,18 @@ def status():
         "keepalive": True
     })
 
+# Image source health API endpoint
+@app.route('/api/sources')
+def sources():
+    import source_health
+    return jsonify(source_health.snapshot())
+
 # Test post endpoints
 @app.route('/api/test/post/<post_type>')
 def test_post(post_type):
-    from api_clients import fetch_reddit_post, get_random_miku_image, reddit_client
+    from api_clients import fetch_reddit_post, get_random_miku_image, get_reddit_client
     from facts import get_random_miku_fact, get_random_miku_caption
-    from handlers import send_post
+    from handlers import send_post, SENT
     from bot import get_bot
     
     # Validate post type
@@ -243,7 +249,7 @@ def test_post(post_type):
         
     elif post_type == 'reddit':
         # Post from Reddit
-        if not reddit_client:
+        if not get_reddit_client():
             return jsonify({
                 "success": False,
                 "message": "Reddit client not initialized. Please add REDDIT_CLIENT_ID and REDDIT_CLIENT_SECRET environment variables."
@@ -260,7 +266,12 @@ def test_post(post_type):
         
     # Try to send the post
     try:
-        send_post(context, content)
+        result = send_post(context, content)
+        if result != SENT:
+            return jsonify({
+                "success": False,
+                "message": f"{post_type.capitalize()} post was not sent ({result}). Check logs for details."
+            }), 500
         return jsonify({
             "success": True,
             "message": f"{post_type.capitalize()} post sent successfully!",